@@ -0,0 +1,113 @@
+import json
+import logging
+import queue
+import sys
+from logging.handlers import QueueHandler, QueueListener
+
+LOG_QUEUE_SIZE = 100_000  # records waiting for the writer thread; newer records are dropped when it is full
+LOG_BATCH_SIZE = 512  # records written with a single write/flush
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    One JSON object per line. A dict passed as the log message (the request context) becomes the fields of the line.
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {"ts": self.formatTime(record, self.datefmt), "level": record.levelname}
+        if isinstance(record.msg, dict):
+            entry.update(record.msg)
+        else:
+            entry["message"] = record.getMessage()
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """
+    Puts records on the queue as they are: formatting is left to the writer thread, and records are dropped
+    instead of blocking the request when the queue is full.
+    """
+
+    dropped: int = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class BatchStreamHandler(logging.StreamHandler):
+    def emit_batch(self, records: list[logging.LogRecord]):
+        lines = []
+        for record in records:
+            if record.levelno < self.level:
+                continue
+            try:
+                lines.append(self.format(record))
+            except Exception:
+                self.handleError(record)
+        if not lines:
+            return
+        with self.lock:
+            self.stream.write(self.terminator.join(lines) + self.terminator)
+            self.flush()
+
+
+class BatchFileHandler(logging.FileHandler, BatchStreamHandler):
+    pass
+
+
+class BatchQueueListener(QueueListener):
+    """
+    Writer thread: drains up to `batch_size` records from the queue at once and hands them to the handlers together.
+    """
+
+    def __init__(self, log_queue, *handlers, batch_size: int = LOG_BATCH_SIZE):
+        super().__init__(log_queue, *handlers)
+        self.batch_size = batch_size
+
+    def _monitor(self):
+        while True:
+            batch = [self.dequeue(True)]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.dequeue(False))
+                except queue.Empty:
+                    break
+
+            stop = any(record is self._sentinel for record in batch)
+            records = [record for record in batch if record is not self._sentinel]
+            for handler in self.handlers:
+                if isinstance(handler, BatchStreamHandler):
+                    handler.emit_batch(records)
+                else:
+                    for record in records:
+                        if record.levelno >= handler.level:
+                            handler.handle(record)
+            if stop:
+                return
+
+
+def setup_logging(filename: str | None = None, level: int = logging.INFO,
+                  queue_size: int = LOG_QUEUE_SIZE) -> BatchQueueListener:
+    """
+    Route all logging through a queue to a background thread writing JSON lines to `filename` (stderr by default).
+    The returned listener is already started; stop it on shutdown to flush the queue.
+    """
+    handler = BatchFileHandler(filename) if filename else BatchStreamHandler(sys.stderr)
+    handler.setFormatter(JsonFormatter(datefmt='%Y.%m.%d %H:%M:%S'))
+
+    log_queue = queue.Queue(queue_size)
+    root = logging.getLogger()
+    root.setLevel(level)
+    root.handlers = [NonBlockingQueueHandler(log_queue)]
+
+    listener = BatchQueueListener(log_queue, handler)
+    listener.start()
+    return listener
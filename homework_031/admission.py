@@ -0,0 +1,92 @@
+import collections
+import threading
+
+MAX_CONCURRENCY = 64  # requests processed at once
+QUEUE_SIZE = 256  # requests waiting for a slot; newer ones are rejected when it is full
+QUEUE_TIMEOUT = 0.1  # seconds a request may wait for a slot
+
+
+class AdmissionController:
+    """
+    Concurrency limiter with a bounded wait queue. A request either gets a slot at once, or waits in the queue for
+    at most `queue_timeout` seconds, or is rejected at once when the queue is full.
+
+    Slots are handed over in FIFO order while the queue is short. Once it grows over `lifo_threshold` the newest
+    waiter is served first: under a spike the oldest ones are about to time out anyway, and serving them would
+    spend the capacity on requests whose clients have likely given up.
+
+    Args:
+        concurrency: int, requests processed at once (default: MAX_CONCURRENCY)
+        queue_size: int, requests waiting for a slot (default: QUEUE_SIZE)
+        queue_timeout: float, time in seconds a request may wait for a slot (default: QUEUE_TIMEOUT)
+        lifo_threshold: int, queue length over which slots are handed over in LIFO order (default: queue_size // 4)
+    """
+
+    def __init__(self, concurrency: int = MAX_CONCURRENCY, queue_size: int = QUEUE_SIZE,
+                 queue_timeout: float = QUEUE_TIMEOUT, lifo_threshold: int | None = None):
+        self.concurrency = concurrency
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.lifo_threshold = queue_size // 4 if lifo_threshold is None else lifo_threshold
+        self.stats = {"admitted": 0, "queued": 0, "rejected": 0, "timeouts": 0}
+
+        self.active = 0
+        self._waiters = collections.deque()
+        self._lock = threading.Lock()
+
+    @property
+    def waiting(self) -> int:
+        return len(self._waiters)
+
+    def acquire(self) -> bool:
+        """
+        Take a processing slot, waiting for it in the queue if needed. Returns False if the request is rejected;
+        otherwise the slot must be given back with `release`.
+        """
+        with self._lock:
+            if self.active < self.concurrency and not self._waiters:
+                self.active += 1
+                self.stats["admitted"] += 1
+                return True
+            if len(self._waiters) >= self.queue_size:
+                self.stats["rejected"] += 1
+                return False
+            waiter = threading.Event()
+            self._waiters.append(waiter)
+            self.stats["queued"] += 1
+
+        if waiter.wait(self.queue_timeout):
+            return True
+        with self._lock:
+            if waiter.is_set():
+                # the slot was handed over right after the wait timed out
+                return True
+            self._waiters.remove(waiter)
+            self.stats["timeouts"] += 1
+            return False
+
+    def release(self):
+        with self._lock:
+            if not self._waiters:
+                self.active -= 1
+                return
+            if len(self._waiters) > self.lifo_threshold:
+                waiter = self._waiters.pop()
+            else:
+                waiter = self._waiters.popleft()
+            # the slot goes to the waiter as is, so `active` does not change
+            self.stats["admitted"] += 1
+            waiter.set()
+
+    def snapshot(self) -> dict:
+        """
+        Counters of admission outcomes together with the current numbers of active and waiting requests.
+        """
+        with self._lock:
+            return {**self.stats, "active": self.active, "waiting": len(self._waiters)}
+
+    def retry_after(self) -> int:
+        """
+        Seconds a rejected client should wait before retrying, growing with the backlog.
+        """
+        return 1 + int(self.waiting * self.queue_timeout / max(self.concurrency, 1))
@@ -2,30 +2,34 @@
 # -*- coding: utf-8 -*-
 
 import datetime
+import functools
 import hashlib
+import hmac
 import json
 import logging
-import uuid
-from http.server import BaseHTTPRequestHandler, HTTPServer
-from optparse import OptionParser
-
-from scoring import get_interests, get_score
+import sys
+import time
 
 SALT = "Otus"
 ADMIN_LOGIN = "admin"
 ADMIN_SALT = "42"
+AUTH_CACHE_SIZE = 100_000  # (account, login, token) triplets with a known verification result
+DATE_CACHE_SIZE = 100_000  # distinct DD.MM.YYYY strings with a known parsed date
 OK = 200
+NOT_MODIFIED = 304
 BAD_REQUEST = 400
 FORBIDDEN = 403
 NOT_FOUND = 404
 INVALID_REQUEST = 422
 INTERNAL_ERROR = 500
+SERVICE_UNAVAILABLE = 503
 ERRORS = {
     BAD_REQUEST: "Bad Request",
     FORBIDDEN: "Forbidden",
     NOT_FOUND: "Not Found",
     INVALID_REQUEST: "Invalid Request",
     INTERNAL_ERROR: "Internal Server Error",
+    SERVICE_UNAVAILABLE: "Service Unavailable",
 }
 
 UNKNOWN = 0
@@ -36,6 +40,8 @@ GENDERS = {
     MALE: "male",
     FEMALE: "female",
 }
+METHODS = ("online_score", "clients_interests", "batch")
+SCORE_ARGUMENTS = ("phone", "email", "birthday", "gender", "first_name", "last_name")
 
 
 class ValidationError(Exception):
@@ -92,6 +98,23 @@ class BaseField:
 
         return value_candidate
 
+    def schema(self) -> dict:
+        """
+        JSON Schema of the values accepted by the field, null included for nullable fields.
+        """
+        return {}
+
+    def _nullable_schema(self, schema: dict) -> dict:
+        return {"anyOf": [schema, {"type": "null"}]} if self.nullable else schema
+
+    def compile(self):
+        """
+        Check of a present, non-null value: returns the value of the field, like `valid_value`. Compiled checks
+        accept typical valid values with a few direct tests and leave everything else, including building error
+        messages, to `valid_value`.
+        """
+        return self.valid_value
+
 
 class CharField(BaseField):
 
@@ -109,6 +132,18 @@ class CharField(BaseField):
                 self.error_messages.update({'type': str_error})
         return value
 
+    def schema(self) -> dict:
+        return self._nullable_schema({"type": "string"})
+
+    def compile(self):
+        valid_value = self.valid_value
+
+        def check(value):
+            if value.__class__ is str:
+                return value
+            return valid_value(value)
+        return check
+
 
 class ArgumentsField(BaseField):
 
@@ -136,6 +171,18 @@ class ArgumentsField(BaseField):
 
         return value
 
+    def schema(self) -> dict:
+        return self._nullable_schema({"type": "object"})
+
+    def compile(self):
+        valid_value = self.valid_value
+
+        def check(value):
+            if value.__class__ is dict and all(key.__class__ is str for key in value):
+                return value
+            return valid_value(value)
+        return check
+
 
 class EmailField(CharField):
 
@@ -154,6 +201,18 @@ class EmailField(CharField):
 
         return value
 
+    def schema(self) -> dict:
+        return self._nullable_schema({"type": "string", "anyOf": [{"maxLength": 0}, {"pattern": "@"}]})
+
+    def compile(self):
+        valid_value = self.valid_value
+
+        def check(value):
+            if value.__class__ is str and '@' in value:
+                return value
+            return valid_value(value)
+        return check
+
 
 class PhoneField(BaseField):
     PHONE_LENGTH = 11
@@ -194,6 +253,56 @@ class PhoneField(BaseField):
 
         return value
 
+    def schema(self) -> dict:
+        pattern = f"^{self.PHONE_CODE}.{{{self.PHONE_LENGTH - 1}}}$"
+        low = int(self.PHONE_CODE) * 10 ** (self.PHONE_LENGTH - 1)
+        return self._nullable_schema({"anyOf": [
+            {"type": "string", "anyOf": [{"maxLength": 0}, {"pattern": pattern}]},
+            {"type": "integer", "minimum": low, "maximum": low + 10 ** (self.PHONE_LENGTH - 1) - 1},
+        ]})
+
+    def compile(self):
+        valid_value = self.valid_value
+        length, code = self.PHONE_LENGTH, self.PHONE_CODE
+
+        def check(value):
+            if value.__class__ is str and len(value) == length and value[0] == code:
+                return value
+            return valid_value(value)
+        return check
+
+
+@functools.lru_cache(maxsize=DATE_CACHE_SIZE)
+def parse_date(value: str) -> datetime.datetime:
+    """
+    DD.MM.YYYY is split on the dots instead of going through strptime. Like strptime, it accepts a day and a month
+    of one digit.
+    """
+    day, month, year = value.split('.') if value.count('.') == 2 else ('', '', '')
+    digits = day + month + year
+    if not (1 <= len(day) <= 2 and 1 <= len(month) <= 2 and len(year) == 4 and digits.isascii() and digits.isdigit()):
+        raise ValueError(f"{value!r} does not match format DD.MM.YYYY")
+    return datetime.datetime(int(year), int(month), int(day))
+
+
+class Today:
+    """Current date changes once a day, so it is computed once and reused until midnight."""
+
+    def __init__(self):
+        self._date = None
+        self._expires_at = 0.
+
+    def get(self) -> datetime.date:
+        now = time.time()
+        if now >= self._expires_at:
+            self._date = datetime.date.today()
+            tomorrow = self._date + datetime.timedelta(days=1)
+            self._expires_at = datetime.datetime.combine(tomorrow, datetime.time()).timestamp()
+        return self._date
+
+
+today = Today()
+
 
 class DateField(BaseField):
 
@@ -203,7 +312,9 @@ class DateField(BaseField):
             return value
 
         try:
-            value = datetime.datetime.strptime(value, "%d.%m.%Y")
+            if not isinstance(value, str):
+                raise ValueError(f"string is expected but object of type {type(value).__name__} received")
+            value = parse_date(value)
         except ValueError:
             str_error = 'Validation Error: The field values must be in the DD.MM.YYYY format'
             if self.error_exception:
@@ -214,22 +325,37 @@ class DateField(BaseField):
 
         return value
 
+    def schema(self) -> dict:
+        return self._nullable_schema({"type": "string", "anyOf": [
+            {"maxLength": 0}, {"pattern": r"^\d{1,2}\.\d{1,2}\.\d{4}$", "format": "DD.MM.YYYY"},
+        ]})
+
+    def compile(self):
+        valid_value = self.valid_value
+
+        def check(value):
+            if value.__class__ is str:
+                try:
+                    return parse_date(value)
+                except ValueError:
+                    pass
+            return valid_value(value)
+        return check
+
 
 class BirthDayField(DateField):
     MAX_AGE = 70
 
-    def age(self, value):
-        value = datetime.datetime.strptime(value, "%d.%m.%Y")
-        today = datetime.datetime.today()
-        result = int(today.year - value.year - ((today.month, today.day) < (value.month, value.day)))
-        return result
+    def age(self, value: datetime.datetime) -> int:
+        current = today.get()
+        return current.year - value.year - ((current.month, current.day) < (value.month, value.day))
 
     def valid_value(self, field_value) -> datetime.datetime | None:
         value = super().valid_value(field_value)
         if value in self._null_values:
             return value
 
-        age = self.age(field_value)
+        age = self.age(value)
         if age < 0:
             str_error = f'Validation Error: the date of the birthday is in the future:{field_value}'
             if self.error_exception:
@@ -247,6 +373,29 @@ class BirthDayField(DateField):
 
         return value
 
+    def schema(self) -> dict:
+        schema = super().schema()
+        schema["description"] = f"Date of birth at most {self.MAX_AGE} years ago"
+        return schema
+
+    def compile(self):
+        valid_value = self.valid_value
+        max_age = self.MAX_AGE
+
+        def check(value):
+            if value.__class__ is str:
+                try:
+                    date = parse_date(value)
+                except ValueError:
+                    pass
+                else:
+                    current = today.get()
+                    age = current.year - date.year - ((current.month, current.day) < (date.month, date.day))
+                    if 0 <= age <= max_age:
+                        return date
+            return valid_value(value)
+        return check
+
 
 class GenderField(BaseField):
     VALID_GENDERS = GENDERS.keys()
@@ -256,7 +405,8 @@ class GenderField(BaseField):
         if value in self._null_values:
             return value
 
-        if value not in self.VALID_GENDERS:
+        # other types are checked first: lists and dicts can not be looked up among the genders at all
+        if not isinstance(value, int) or value not in self.VALID_GENDERS:
             str_error = f'Validation Error: the field can take the following values: {self.VALID_GENDERS}'
             if self.error_exception:
                 raise ValidationError(str_error)
@@ -266,6 +416,19 @@ class GenderField(BaseField):
 
         return field_value
 
+    def schema(self) -> dict:
+        return self._nullable_schema({"enum": list(self.VALID_GENDERS)})
+
+    def compile(self):
+        valid_value = self.valid_value
+        genders = frozenset(self.VALID_GENDERS)
+
+        def check(value):
+            if value.__class__ is int and value in genders:
+                return value
+            return valid_value(value)
+        return check
+
 
 class ClientIDsField(BaseField):
 
@@ -299,27 +462,148 @@ class ClientIDsField(BaseField):
 
         return value
 
+    def schema(self) -> dict:
+        return {"type": "array", "items": {"type": "integer"}, "minItems": 1}
+
+    def compile(self):
+        valid_value = self.valid_value
+
+        def check(value):
+            if value.__class__ is list and value and all(client_id.__class__ is int for client_id in value):
+                return value
+            return valid_value(value)
+        return check
+
+
+class MethodRequestsField(BaseField):
+    MAX_REQUESTS = 1000
+
+    def __init__(self, required: bool):
+        super().__init__(required, nullable=False)
+
+    def valid_value(self, field_value) -> list[dict]:
+        value = super().valid_value(field_value)
+
+        if not isinstance(value, list) or len(value) == 0:
+            str_error = 'Validation Error: requests must be a non-empty list of method requests'
+            if self.error_exception:
+                raise ValidationError(str_error)
+            else:
+                logging.exception(str_error)
+                self.error_messages.update({'type': str_error})
+        if len(value) > self.MAX_REQUESTS:
+            str_error = f'Validation Error: a batch may contain at most {self.MAX_REQUESTS} requests'
+            if self.error_exception:
+                raise ValidationError(str_error)
+            else:
+                logging.exception(str_error)
+                self.error_messages.update({'type': str_error})
+        if not all(isinstance(item, dict) for item in value):
+            str_error = 'Validation Error: every batch item must be a JSON object'
+            if self.error_exception:
+                raise ValidationError(str_error)
+            else:
+                logging.exception(str_error)
+                self.error_messages.update({'type': str_error})
+
+        return value
+
+    def schema(self) -> dict:
+        return {"type": "array", "items": {"type": "object"}, "minItems": 1, "maxItems": self.MAX_REQUESTS}
+
+
+def compile_validator(fields: tuple):
+    """
+    Validator of a decoded request for the given (name, field) pairs: returns a tuple of the values of the fields
+    and raises ValidationError on the first invalid one. The checks of all fields are generated into the body of
+    a single function, absent optional fields get their null value computed here once.
+    """
+    namespace = {"ValidationError": ValidationError}
+    lines = ["def validate(request):", "    get = request.get"]
+    for index, (field_name, field) in enumerate(fields):
+        namespace[f"name_{index}"] = field_name
+        namespace[f"check_{index}"] = field.compile()
+        lines += [
+            f"    value_{index} = get(name_{index})",
+            f"    if value_{index} is not None:",
+            f"        value_{index} = check_{index}(value_{index})",
+        ]
+        if field.required or not field.nullable:
+            namespace[f"field_{index}"] = field
+            namespace[f"missing_{index}"] = f'Field "{field_name}" is required but not provided in request'
+            if field.required:
+                lines += [
+                    f"    elif name_{index} not in request:",
+                    f"        raise ValidationError(missing_{index})",
+                ]
+            lines += [
+                "    else:",
+                f"        value_{index} = field_{index}.valid_value(None)",
+            ]
+        else:
+            namespace[f"null_{index}"] = field.valid_value(None)
+            lines += [
+                "    else:",
+                f"        value_{index} = null_{index}",
+            ]
+    lines.append(f"    return ({''.join(f'value_{index}, ' for index in range(len(fields)))})")
+    exec("\n".join(lines), namespace)
+    return namespace["validate"]
+
 
 class MetaRequest(type):
     def __new__(mcs, class_name, parents, attributes):
-        def init(self, request: dict):
-            self._field_names = []
-            for field_name, field in attributes.items():
-                if isinstance(field, BaseField):
-                    if field_name not in request and field.required:
-                        raise ValidationError(f'Field "{field_name}" is required but not provided in request')
-                    field_value = request.get(field_name)
-                    field.__set__(self, field_value)
-                    self._field_names.append(field_name)
-
-            if hasattr(self, 'validate_values'):
-                self.validate_values()
+        # fields are collected once per class: instances keep values in slots generated
+        # from the declared fields instead of a per-instance __dict__
+        own_fields = tuple(
+            (field_name, field)
+            for field_name, field in attributes.items()
+            if isinstance(field, BaseField)
+        )
+        fields = tuple(item for parent in parents for item in getattr(parent, '_fields', ())) + own_fields
+        own_slots = tuple(f"_{field_name}" for field_name, _ in own_fields)
+        slots = tuple(f"_{field_name}" for field_name, _ in fields)
 
-        return super().__new__(mcs, class_name, parents, {**attributes, '__init__': init})
+        def init(self, request: dict):
+            # values are checked on the decoded dict at once and stored in the slots as they are,
+            # bypassing the per-field descriptors
+            for set_slot, value in zip(set_slots, validate(request)):
+                set_slot(self, value)
+
+            if validate_values is not None:
+                validate_values(self)
+
+        cls = super().__new__(mcs, class_name, parents, {
+            **attributes,
+            '__slots__': tuple(attributes.get('__slots__', ())) + own_slots,
+            '__init__': init,
+            '_fields': fields,
+            '_field_names': tuple(field_name for field_name, _ in fields),
+        })
+        # fields learn their names in __set_name__, when the class is created
+        validate = compile_validator(fields)
+        set_slots = tuple(getattr(cls, slot).__set__ for slot in slots)
+        validate_values = getattr(cls, 'validate_values', None)
+        cls._validate = staticmethod(validate)
+        return cls
 
 
 class BaseRequest(metaclass=MetaRequest):
-    pass
+    schema_rules = {}  # JSON Schema keywords for checks across fields, see validate_values
+
+    @classmethod
+    def json_schema(cls) -> dict:
+        """
+        JSON Schema of the decoded request accepted by the class.
+        """
+        return {
+            "$schema": "https://json-schema.org/draft/2020-12/schema",
+            "title": cls.__name__,
+            "type": "object",
+            "properties": {field_name: field.schema() for field_name, field in cls._fields},
+            "required": [field_name for field_name, field in cls._fields if field.required],
+            **cls.schema_rules,
+        }
 
 
 class ClientsInterestsRequest(BaseRequest):
@@ -335,6 +619,12 @@ class OnlineScoreRequest(BaseRequest):
     birthday = BirthDayField(required=False, nullable=True)
     gender = GenderField(required=False, nullable=True)
 
+    schema_rules = {"anyOf": [
+        {"properties": {first: {"not": {"type": "null"}}, second: {"not": {"type": "null"}}},
+         "required": [first, second]}
+        for first, second in (("first_name", "last_name"), ("email", "phone"), ("birthday", "gender"))
+    ]}
+
     def validate_values(self):
         if (
                 (self.first_name is None or self.last_name is None)
@@ -344,6 +634,10 @@ class OnlineScoreRequest(BaseRequest):
             raise ValidationError("Not enough data provided")
 
 
+class BatchRequest(BaseRequest):
+    requests = MethodRequestsField(required=True)
+
+
 class MethodRequest(BaseRequest):
     account = CharField(required=False, nullable=True)
     login = CharField(required=True, nullable=True)
@@ -356,139 +650,125 @@ class MethodRequest(BaseRequest):
         return self.login == ADMIN_LOGIN
 
 
-def check_auth(request):
-    if request.is_admin:
-        str_request = datetime.datetime.now().strftime("%Y%m%d%H") + ADMIN_SALT
-        digest = hashlib.sha512(str_request.encode('utf-8')).hexdigest()
-    else:
-        str_request = str(request.account) + str(request.login) + str(SALT)
-        digest = hashlib.sha512(str_request.encode('utf-8')).hexdigest()
-    if digest == request.token:
-        return True
-    return False
-
-
-def online_score_handler(request: dict, is_admin: bool, ctx: dict, store) -> tuple[any, int]:
-    online_score_request = OnlineScoreRequest(request)
-    if not is_admin:
-        response = {
-            "score": get_score(
-                store=store,
-                phone=online_score_request.phone,
-                email=online_score_request.email,
-                birthday=online_score_request.birthday,
-                gender=online_score_request.gender,
-                first_name=online_score_request.first_name,
-                last_name=online_score_request.last_name
-            )
-        }
-    else:
-        response = {"score": 42}
-    code = OK
-
-    ctx['has'] = [
-        field_name
-        for field_name in online_score_request._field_names
-        if getattr(online_score_request, field_name) is not None
-    ]
-
-    return response, code
-
-
-def clients_interests_handler(request: dict, ctx: dict, store) -> tuple[any, int]:
-    clients_interests_request = ClientsInterestsRequest(request)
+class AdminToken:
+    """Admin token depends only on the current hour, so it is computed once and reused until the hour changes."""
 
-    response = {
-        client_id: get_interests(store, client_id)
-        for client_id in clients_interests_request.client_ids
-    }
-    code = OK
+    def __init__(self):
+        self._digest = b''
+        self._expires_at = 0.
 
-    ctx['nclients'] = len(response)
+    def get(self) -> bytes:
+        now = time.time()
+        if now >= self._expires_at:
+            current_hour = datetime.datetime.now().replace(minute=0, second=0, microsecond=0)
+            str_request = current_hour.strftime("%Y%m%d%H") + ADMIN_SALT
+            self._digest = hashlib.sha512(str_request.encode('utf-8')).hexdigest().encode('ascii')
+            self._expires_at = (current_hour + datetime.timedelta(hours=1)).timestamp()
+        return self._digest
 
-    return response, code
 
+admin_token = AdminToken()
 
-def method_handler(request: dict, ctx: dict, store) -> tuple[any, int]:
-    try:
-        method_request = MethodRequest(request['body'])
 
-        if not check_auth(method_request):
-            response = "Invalid authentication token"
-            code = FORBIDDEN
-            return response, code
+@functools.lru_cache(maxsize=AUTH_CACHE_SIZE)
+def check_user_token(account, login, token) -> bool:
+    str_request = str(account) + str(login) + str(SALT)
+    digest = hashlib.sha512(str_request.encode('utf-8')).hexdigest()
+    return hmac.compare_digest(digest.encode('ascii'), str(token).encode('utf-8'))
 
-        if method_request.method == "online_score":
-            response, code = online_score_handler(method_request.arguments, method_request.is_admin, ctx, store)
-        elif method_request.method == "clients_interests":
-            response, code = clients_interests_handler(method_request.arguments, ctx, store)
-        else:
-            response = f"Requested method {method_request.method} not found"
-            code = NOT_FOUND
-    except ValidationError as e:
-        response = str(e)
-        code = INVALID_REQUEST
 
-    return response, code
+def check_auth(request):
+    if request.is_admin:
+        return hmac.compare_digest(admin_token.get(), str(request.token).encode('utf-8'))
+    credentials = (request.account, request.login, request.token)
+    # null values of other types ([] or {}) pass CharField, but they are neither valid credentials nor hashable
+    if not all(value is None or isinstance(value, str) for value in credentials):
+        return False
+    return check_user_token(*credentials)
+
+
+def make_token(account: str | None, login: str) -> str:
+    """
+    Token `check_auth` accepts for the account and login; the admin token is valid until the end of the current hour.
+    """
+    if login == ADMIN_LOGIN:
+        return admin_token.get().decode('ascii')
+    return hashlib.sha512((str(account or "") + login + SALT).encode('utf-8')).hexdigest()
+
+
+ARGUMENTS_REQUESTS = {
+    "online_score": OnlineScoreRequest,
+    "clients_interests": ClientsInterestsRequest,
+    "batch": BatchRequest,
+}
 
 
-class MainHTTPHandler(BaseHTTPRequestHandler):
-    router = {
-        "method": method_handler
-    }
-    store = None
+def validate_request(body, batch_item: bool = False) -> None:
+    """
+    Validate a decoded method request and its arguments the way method_handler does, without authentication.
+    Raises ValidationError with the message method_handler would respond with.
+
+    Args:
+        body: decoded request
+        batch_item: bool, the request is an item of a batch, which can not be a batch itself (default: False)
+    """
+    if not isinstance(body, dict):
+        raise ValidationError("Request must be a JSON object")
+    method_request = MethodRequest(body)
+    method = method_request.method
+    request_class = ARGUMENTS_REQUESTS.get(method) if isinstance(method, str) else None
+    if request_class is None or (batch_item and request_class is BatchRequest):
+        raise ValidationError(f"Requested method {method} not found")
+    arguments = request_class(method_request.arguments)
+    if request_class is BatchRequest:
+        for item in arguments.requests:
+            validate_request(item, batch_item=True)
+
+
+def validate_command(args: list[str]) -> int:
+    from optparse import OptionParser
+
+    op = OptionParser(usage="%prog validate [options] FILE",
+                      description="Validate a JSON lines file of method requests without authentication "
+                                  "and print the numbers of valid records and of every error as JSON.")
+    op.add_option("-o", "--valid-output", action="store", default=None, help="file to write valid records to")
+    op.add_option("-e", "--invalid-output", action="store", default=None,
+                  help="file to write invalid records to, with their line numbers and errors")
+    op.add_option("-j", "--processes", action="store", type=int, default=1,
+                  help="worker processes validating blocks of the file")
+    (opts, paths) = op.parse_args(args)
+    if len(paths) != 1:
+        op.error("a request file is required")
+
+    from bulk_validate import validate_file
+
+    report = validate_file(paths[0], opts.valid_output, opts.invalid_output, opts.processes)
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    return 0 if report["valid"] == report["records"] else 1
+
+
+def token_command(args: list[str]) -> int:
+    from optparse import OptionParser
+
+    op = OptionParser(usage="%prog token [options]", description="Print a valid token for the account and login.")
+    op.add_option("-a", "--account", action="store", default="horns&hoofs")
+    op.add_option("-u", "--login", action="store", default="h&f", help=f"{ADMIN_LOGIN} for the admin token")
+    (opts, args) = op.parse_args(args)
+    print(make_token(opts.account, opts.login))
+    return 0
+
+
+# commands that only need the request classes; the server machinery is not even imported for them
+COMMANDS = {
+    "validate": validate_command,
+    "token": token_command,
+}
 
-    def get_request_id(self, headers):
-        return headers.get('HTTP_X_REQUEST_ID', uuid.uuid4().hex)
 
-    def do_POST(self):
-        response, code = {}, OK
-        context = {"request_id": self.get_request_id(self.headers)}
-        request = None
-        try:
-            data_string = self.rfile.read(int(self.headers['Content-Length'])).decode("utf-8")
-            request = json.loads(data_string)
-        except Exception as e:
-            response = f"Error reading or parsing request: {e}"
-            code = BAD_REQUEST
-
-        if request:
-            path = self.path.strip("/")
-            logging.info("%s: %s %s" % (self.path, data_string, context["request_id"]))
-            if path in self.router:
-                try:
-                    response, code = self.router[path]({"body": request, "headers": self.headers}, context, self.store)
-                except Exception as e:
-                    logging.exception("Unexpected error: %s" % e)
-                    code = INTERNAL_ERROR
-            else:
-                response = f"Path {self.path} not found"
-                code = NOT_FOUND
-
-        self.send_response(code)
-        self.send_header("Content-Type", "application/json")
-        self.end_headers()
-        if code not in ERRORS:
-            r = {"response": response, "code": code}
-        else:
-            r = {"error": response or ERRORS.get(code, "Unknown Error"), "code": code}
-        context.update(r)
-        logging.info(context)
-        self.wfile.write(json.dumps(r).encode('utf-8'))
-        return
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] in COMMANDS:
+        sys.exit(COMMANDS[sys.argv[1]](sys.argv[2:]))
 
+    from api_server import main
 
-if __name__ == "__main__":
-    op = OptionParser()
-    op.add_option("-p", "--port", action="store", type=int, default=8080)
-    op.add_option("-l", "--log", action="store", default=None)
-    (opts, args) = op.parse_args()
-    logging.basicConfig(filename=opts.log, level=logging.INFO,
-                        format='[%(asctime)s] %(levelname).1s %(message)s', datefmt='%Y.%m.%d %H:%M:%S')
-    server = HTTPServer(("localhost", opts.port), MainHTTPHandler)
-    logging.info("Starting server at %s" % opts.port)
-    try:
-        server.serve_forever()
-    except KeyboardInterrupt:
-        pass
-    server.server_close()
+    main()
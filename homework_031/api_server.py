@@ -0,0 +1,623 @@
+"""
+HTTP server of the scoring API: method handlers, the request handler and the life cycle of worker processes.
+Started by `python api.py`; command-line uses of api.py do not import it.
+"""
+import email.utils
+import functools
+import gzip
+import hashlib
+import logging
+import os
+import random
+import socket
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from optparse import OptionParser
+
+import scoring
+from admission import MAX_CONCURRENCY, QUEUE_SIZE, QUEUE_TIMEOUT, AdmissionController
+from api import (
+    BAD_REQUEST, ERRORS, FORBIDDEN, INTERNAL_ERROR, INVALID_REQUEST, METHODS, NOT_FOUND, NOT_MODIFIED, OK,
+    SCORE_ARGUMENTS, SERVICE_UNAVAILABLE, BaseField, BatchRequest, ClientsInterestsRequest, MethodRequest,
+    SALT, OnlineScoreRequest, ValidationError, check_auth,
+)
+from capture import CAPTURE_SAMPLE_RATE, TrafficCapture
+from json_codec import available_codecs, get_codec
+from metrics import Metrics, timed
+from scoring import get_interests_many, get_score, get_score_bulk, interests_cache
+from store import CircuitBreaker, Deadline, ShardedStore, Store, StoreError
+from supervisor import Supervisor
+from warmup import WARMUP_TIMEOUT, Warmup, keys_from_access_log, keys_from_file
+
+ERROR_CACHE_SIZE = 1024  # encoded error responses; validation and auth errors come from a small set of messages
+KEEP_ALIVE_TIMEOUT = 5  # seconds
+KEEP_ALIVE_MAX_REQUESTS = 1000
+BODY_SAMPLE_RATE = 0.01  # share of requests whose raw body is logged
+STORE_BUDGET = 0.5  # seconds a request may spend waiting on the store
+STORE_RETRY_AFTER = 1  # seconds clients are asked to wait before retrying a request the store failed
+DRAIN_TIMEOUT = 30  # seconds a stopping worker waits for in-flight requests
+MAX_BODY_SIZE = 16 << 20  # bytes; larger request bodies are rejected before they are read
+GZIP_MIN_SIZE = 1024  # bytes; smaller responses are sent as they are, compressing them costs more than it saves
+GZIP_LEVEL = 5
+# an ETag is valid for the data version it was computed with and for at most ETAG_TTL seconds, as long as
+# cached interests may be served
+ETAG_TTL = 5 * 60
+
+
+def online_score_handler(request: dict, is_admin: bool, ctx: dict, store) -> tuple[any, int]:
+    with timed(ctx, "validate"):
+        online_score_request = OnlineScoreRequest(request)
+    if not is_admin:
+        response = {
+            "score": get_score(
+                store=store,
+                phone=online_score_request.phone,
+                email=online_score_request.email,
+                birthday=online_score_request.birthday,
+                gender=online_score_request.gender,
+                first_name=online_score_request.first_name,
+                last_name=online_score_request.last_name
+            )
+        }
+    else:
+        response = {"score": 42}
+    code = OK
+
+    ctx['has'] = [
+        field_name
+        for field_name in online_score_request._field_names
+        if getattr(online_score_request, field_name) is not None
+    ]
+
+    return response, code
+
+
+def clients_interests_handler(request: dict, ctx: dict, store) -> tuple[any, int]:
+    with timed(ctx, "validate"):
+        clients_interests_request = ClientsInterestsRequest(request)
+
+    response = get_interests_many(store, clients_interests_request.client_ids)
+    code = OK
+
+    ctx['nclients'] = len(response)
+
+    return response, code
+
+
+def build_envelope(response, code) -> dict:
+    if code not in ERRORS:
+        return {"response": response, "code": code}
+    return {"error": response or ERRORS.get(code, "Unknown Error"), "code": code}
+
+
+@functools.lru_cache(maxsize=ERROR_CACHE_SIZE)
+def encode_error(codec, error: str, code: int) -> bytes:
+    """
+    Encoded envelope of an error response, built once per codec, message and code.
+    """
+    return codec.dumps(build_envelope(error, code))
+
+
+@functools.lru_cache(maxsize=1)
+def http_date(second: int) -> str:
+    return email.utils.formatdate(second, usegmt=True)
+
+
+@functools.lru_cache(maxsize=None)
+def status_head(protocol_version: str, code: int, phrase: str, server: str) -> bytes:
+    """
+    Status line and Server header of a response, the same for every response with the code.
+    """
+    return f"{protocol_version} {code} {phrase}\r\nServer: {server}\r\n".encode("latin-1")
+
+
+def batch_handler(request: dict, ctx: dict, store) -> tuple[any, int]:
+    with timed(ctx, "validate"):
+        batch_request = BatchRequest(request)
+    results = [None] * len(batch_request.requests)
+    verified = {}
+    score_items = []
+    interests_items = []
+
+    # first pass: authenticate every distinct credential once and validate all items
+    for index, item in enumerate(batch_request.requests):
+        try:
+            method_request = MethodRequest(item)
+            credentials = (method_request.account, method_request.login, method_request.token)
+            try:
+                authorized = verified.get(credentials)
+            except TypeError:
+                # null values of other types ([] or {}) are not hashable, nor are they valid credentials
+                authorized = False
+            if authorized is None:
+                authorized = verified[credentials] = check_auth(method_request)
+            if not authorized:
+                results[index] = build_envelope("Invalid authentication token", FORBIDDEN)
+            elif method_request.method == "online_score":
+                score_request = OnlineScoreRequest(method_request.arguments)
+                if method_request.is_admin:
+                    results[index] = build_envelope({"score": 42}, OK)
+                    continue
+                # null values of any type score as missing ones
+                score_items.append((index, tuple(
+                    None if value in BaseField._null_values else value
+                    for value in (getattr(score_request, field_name) for field_name in SCORE_ARGUMENTS)
+                )))
+            elif method_request.method == "clients_interests":
+                interests_items.append((index, ClientsInterestsRequest(method_request.arguments)))
+            else:
+                results[index] = build_envelope(f"Requested method {method_request.method} not found", NOT_FOUND)
+        except ValidationError as e:
+            results[index] = build_envelope(str(e), INVALID_REQUEST)
+
+    # second pass: identical arguments are scored once, all of them with a single read of the store cache
+    score_args = list(dict.fromkeys(args for _, args in score_items))
+    if score_args:
+        scores = dict(zip(score_args, get_score_bulk(store, *(list(column) for column in zip(*score_args)))))
+        for index, args in score_items:
+            results[index] = build_envelope({"score": float(scores[args])}, OK)
+
+    # third pass: each distinct client is looked up once for the whole batch
+    client_ids = {client_id for _, item in interests_items for client_id in item.client_ids}
+    interests = get_interests_many(store, client_ids)
+    for index, item in interests_items:
+        results[index] = build_envelope({client_id: interests[client_id] for client_id in item.client_ids}, OK)
+
+    ctx['nrequests'] = len(results)
+    ctx['nclients'] = len(client_ids)
+
+    return results, OK
+
+
+def method_handler(request: dict, ctx: dict, store) -> tuple[any, int]:
+    try:
+        if hasattr(store, "session"):
+            # every store call of the request shares one deadline, so a slow store can not hold a worker for longer
+            deadline = Deadline(request.get("store_budget", STORE_BUDGET))
+            try:
+                return dispatch_method(request, ctx, store.session(deadline))
+            finally:
+                ctx['store_wait'] = round(deadline.store_wait, 6)
+        return dispatch_method(request, ctx, store)
+    except StoreError as e:
+        # the store is down or slow, the client may retry later; a traceback per request would only flood the log
+        logging.warning("Store error in request %s: %s" % (ctx.get("request_id"), e))
+        return ERRORS[SERVICE_UNAVAILABLE], SERVICE_UNAVAILABLE
+
+
+def dispatch_method(request: dict, ctx: dict, store) -> tuple[any, int]:
+    try:
+        with timed(ctx, "validate"):
+            method_request = MethodRequest(request['body'])
+        ctx['method'] = method_request.method
+
+        with timed(ctx, "auth"):
+            authorized = check_auth(method_request)
+        if not authorized:
+            response = "Invalid authentication token"
+            code = FORBIDDEN
+            return response, code
+
+        # handlers validate their arguments themselves, that time is accounted in the validate phase
+        validate_time = ctx["timings"]["validate"]
+        started = time.perf_counter()
+        try:
+            if method_request.method == "online_score":
+                response, code = online_score_handler(method_request.arguments, method_request.is_admin, ctx, store)
+            elif method_request.method == "clients_interests":
+                response, code = clients_interests_handler(method_request.arguments, ctx, store)
+            elif method_request.method == "batch":
+                response, code = batch_handler(method_request.arguments, ctx, store)
+            else:
+                response = f"Requested method {method_request.method} not found"
+                code = NOT_FOUND
+        finally:
+            ctx["timings"]["handler"] = time.perf_counter() - started - (ctx["timings"]["validate"] - validate_time)
+    except ValidationError as e:
+        response = str(e)
+        code = INVALID_REQUEST
+
+    return response, code
+
+
+class MainHTTPHandler(BaseHTTPRequestHandler):
+    router = {
+        "method": method_handler
+    }
+    store = None
+    store_budget = STORE_BUDGET
+    codec = get_codec()
+    metrics = Metrics()
+    admission = AdmissionController()
+    body_sample_rate = BODY_SAMPLE_RATE
+    draining = False  # the worker is shutting down, persistent connections are closed after the current response
+    data_version = "1"  # part of every ETag, changed when the stored data changes
+    gzip_min_size = GZIP_MIN_SIZE
+    warmup = None  # warmup.Warmup of the worker; it is not ready until the warm-up is over
+    capture = None  # capture.TrafficCapture sampled requests are recorded to for replay
+
+    # persistent connections: idle connections are closed after `timeout` seconds,
+    # busy ones after `max_requests` requests
+    protocol_version = "HTTP/1.1"
+    timeout = KEEP_ALIVE_TIMEOUT
+    max_requests = KEEP_ALIVE_MAX_REQUESTS
+    # send_body writes headers and body at once, but errors sent by BaseHTTPRequestHandler itself are written in
+    # parts; with Nagle's algorithm the last part on a persistent connection waits for the client's delayed ACK
+    disable_nagle_algorithm = True
+    # handlers of open connections, so that a stopping worker can close the idle ones and wait for the rest
+    open_connections = set()
+    _connections_lock = threading.Lock()
+
+    def setup(self):
+        super().setup()
+        self.requests_served = 0
+        self.idle = True  # waiting for the request line of the next request
+        with self._connections_lock:
+            self.open_connections.add(self)
+
+    def finish(self):
+        try:
+            super().finish()
+        finally:
+            with self._connections_lock:
+                self.open_connections.discard(self)
+
+    def handle_one_request(self):
+        try:
+            super().handle_one_request()
+        finally:
+            self.idle = True
+
+    def parse_request(self) -> bool:
+        # the request line is read, from now on the connection is busy until the response is sent
+        with self._connections_lock:
+            self.idle = False
+        return super().parse_request()
+
+    @classmethod
+    def close_idle_connections(cls) -> int:
+        """
+        Stop reading from connections that wait for another request; their handlers see the end of the stream and
+        close them. Busy connections are closed after the current response while the worker is draining.
+        Returns the number of open connections.
+        """
+        with cls._connections_lock:
+            for handler in cls.open_connections:
+                if handler.idle:
+                    try:
+                        handler.connection.shutdown(socket.SHUT_RD)
+                    except OSError:
+                        pass
+            return len(cls.open_connections)
+
+    def log_message(self, format, *args):
+        # errors BaseHTTPRequestHandler answers itself go through the log queue instead of a write to stderr
+        logging.info({"client": self.address_string(), "message": format % args})
+
+    def get_request_id(self, headers):
+        return headers.get('HTTP_X_REQUEST_ID', uuid.uuid4().hex)
+
+    def send_body(self, code: int, body: bytes, content_type: str = "application/json", headers: dict = None):
+        self.requests_served += 1
+        if self.requests_served >= self.max_requests or self.draining:
+            self.close_connection = True
+
+        if len(body) >= self.gzip_min_size and self.accepts_gzip():
+            body = gzip.compress(body, GZIP_LEVEL, mtime=0)
+            headers = {**(headers or {}), "Content-Encoding": "gzip"}
+
+        # status line, headers and body go out with one write, i.e. one send call and, mostly, one TCP segment;
+        # the request is logged by process_post, not by log_request
+        lines = [f"Date: {http_date(int(time.time()))}",
+                 f"Content-Type: {content_type}",
+                 f"Content-Length: {len(body)}"]
+        if body:
+            lines.append("Vary: Accept-Encoding")
+        for name, value in (headers or {}).items():
+            lines.append(f"{name}: {value}")
+        if self.close_connection:
+            lines.append("Connection: close")
+        else:
+            lines.append(f"Keep-Alive: timeout={self.timeout:g}, max={self.max_requests - self.requests_served}")
+        lines.append("\r\n")
+        phrase = self.responses[code][0] if code in self.responses else ""
+        head = status_head(self.protocol_version, code, phrase, self.version_string())
+        self.wfile.write(head + "\r\n".join(lines).encode("latin-1") + body)
+
+    def accepts_gzip(self) -> bool:
+        for coding in self.headers.get("Accept-Encoding", "").split(","):
+            name, _, parameters = coding.partition(";")
+            if name.strip().lower() in ("gzip", "*"):
+                quality = parameters.replace(" ", "").lower().removeprefix("q=")
+                try:
+                    return not parameters or float(quality) > 0
+                except ValueError:
+                    return False
+        return False
+
+    def get_etag(self, request) -> str:
+        """
+        Weak ETag of the canonicalized request, the data version and the current ETAG_TTL period. Keyed with the
+        salt, so that a client can only present an ETag it was given for exactly this request, token included.
+        """
+        digest = hashlib.blake2b(self.codec.canonical(request), digest_size=16, key=SALT.encode('utf-8'))
+        digest.update(f"{self.data_version}:{int(time.time() // ETAG_TTL)}".encode('utf-8'))
+        return f'W/"{digest.hexdigest()}"'
+
+    def not_modified(self, etag: str) -> bool:
+        for candidate in self.headers.get("If-None-Match", "").split(","):
+            if candidate.strip().removeprefix("W/") == etag.removeprefix("W/"):
+                return True
+        return False
+
+    def do_GET(self):
+        if self.path == "/ready":
+            if self.warmup is None or self.warmup.ready:
+                self.send_body(OK, self.codec.dumps(build_envelope({"ready": True}, OK)))
+            else:
+                self.send_body(SERVICE_UNAVAILABLE, encode_error(self.codec, "Warming up", SERVICE_UNAVAILABLE),
+                               headers={"Retry-After": "1"})
+        elif self.path == "/metrics":
+            body = self.metrics.render(getattr(self.store, "stats", None), self.admission.snapshot())
+            self.send_body(OK, body.encode("utf-8"), content_type="text/plain; version=0.0.4; charset=utf-8")
+        else:
+            self.send_body(NOT_FOUND, self.codec.dumps(build_envelope(f"Path {self.path} not found", NOT_FOUND)))
+
+    def do_POST(self):
+        started = time.perf_counter()
+        context = {"request_id": self.get_request_id(self.headers), "path": self.path}
+        with timed(context, "queue"):
+            admitted = self.admission.acquire()
+        if not admitted:
+            # rejected before the body is read, so the rest of the stream is unusable
+            self.close_connection = True
+            body = encode_error(self.codec, ERRORS[SERVICE_UNAVAILABLE], SERVICE_UNAVAILABLE)
+            self.send_body(SERVICE_UNAVAILABLE, body, headers={"Retry-After": str(self.admission.retry_after())})
+            return
+        try:
+            self.process_post(started, context)
+        finally:
+            self.admission.release()
+
+    def process_post(self, started: float, context: dict):
+        response, code = {}, OK
+        request = data = None
+        etag = None
+        try:
+            content_length = int(self.headers['Content-Length'])
+            if not 0 <= content_length <= MAX_BODY_SIZE:
+                raise ValueError(f"Content-Length must be from 0 to {MAX_BODY_SIZE}, got {content_length}")
+        except (TypeError, ValueError) as e:
+            # the request body can not be framed, so the rest of the stream is unusable
+            self.close_connection = True
+            response = f"Error reading or parsing request: {e}"
+            code = BAD_REQUEST
+        else:
+            try:
+                data = self.rfile.read(content_length)
+                with timed(context, "parse"):
+                    request = self.codec.loads(data)
+            except Exception as e:
+                response = f"Error reading or parsing request: {e}"
+                code = BAD_REQUEST
+
+        if request:
+            path = self.path.strip("/")
+            if self.body_sample_rate and random.random() < self.body_sample_rate:
+                logging.info({"request_id": context["request_id"], "body": data.decode("utf-8", "replace")})
+            if path in self.router:
+                etag = self.get_etag(request)
+            if etag and self.not_modified(etag):
+                # the client already has the response, so the handler is not called
+                code = NOT_MODIFIED
+            elif path in self.router:
+                try:
+                    response, code = self.router[path](
+                        {"body": request, "headers": self.headers, "store_budget": self.store_budget},
+                        context,
+                        self.store
+                    )
+                except Exception as e:
+                    logging.exception("Unexpected error: %s" % e)
+                    code = INTERNAL_ERROR
+            else:
+                response = f"Path {self.path} not found"
+                code = NOT_FOUND
+
+        if code in ERRORS and (response is None or isinstance(response, str)):
+            # fast path: the error is sent as encoded before, no envelope is built for it or merged into the log
+            error = response or ERRORS[code]
+            body = encode_error(self.codec, error, code)
+            context["error"] = error
+        elif code == NOT_MODIFIED:
+            body = b""
+        else:
+            with timed(context, "serialize"):
+                body = self.codec.dumps(build_envelope(response, code))
+        # responses are not logged: large ones would be serialized once more by the log formatter
+        context["code"] = code
+        context["request_bytes"] = len(data) if data is not None else 0
+        context["response_bytes"] = len(body)
+        if code == SERVICE_UNAVAILABLE:
+            headers = {"Retry-After": str(STORE_RETRY_AFTER)}
+        else:
+            headers = {"ETag": etag} if etag and code in (OK, NOT_MODIFIED) else None
+        self.send_body(code, body, headers=headers)
+        context["timings"]["total"] = time.perf_counter() - started
+        # unknown methods share one label, so that clients can not blow up the number of series
+        method = context.get("method") if context.get("method") in METHODS else "unknown"
+        self.metrics.observe_request(method, code, context["timings"])
+        if self.capture and data is not None and self.capture.sampled():
+            total = context["timings"]["total"]
+            self.capture.record(time.time() - total, self.path, data, code, total)
+        logging.info(context)
+
+
+class ServerWorker:
+    """
+    Life cycle of a worker process serving MainHTTPHandler, driven by supervisor.Supervisor.
+
+    Args:
+        log: str, file to write JSON log lines to (default: stderr)
+        warm_interests: int, hot keys loaded into local caches at start (default: 0)
+        warm_keys: str, file with hot keys, hottest first (default: sample the access log, or scan the store)
+        warm_timeout: float, time in seconds after which the worker is ready even if the warm-up has not finished
+                      (default: WARMUP_TIMEOUT)
+        cache_snapshot: str, file the interests cache is handed over through on reload (default: no handover)
+        drain_timeout: float, time in seconds to wait for open connections on stop (default: DRAIN_TIMEOUT)
+    """
+
+    def __init__(self, log: str | None = None, warm_interests: int = 0, warm_keys: str | None = None,
+                 warm_timeout: float = WARMUP_TIMEOUT, cache_snapshot: str | None = None,
+                 drain_timeout: float = DRAIN_TIMEOUT):
+        self.log = log
+        self.warm_interests = warm_interests
+        self.warm_keys = warm_keys
+        self.warm_timeout = warm_timeout
+        self.cache_snapshot = cache_snapshot
+        self.drain_timeout = drain_timeout
+        self.log_listener = None
+
+    def hot_keys(self) -> list[str]:
+        if not self.warm_interests:
+            return []
+        if self.warm_keys:
+            return keys_from_file(self.warm_keys, self.warm_interests)
+        if self.log and os.path.exists(self.log):
+            return keys_from_access_log(self.log, self.warm_interests)
+        return MainHTTPHandler.store.scan("i:*", self.warm_interests)
+
+    def start(self):
+        from access_log import setup_logging
+
+        # threads do not survive fork, so every worker starts its own log writer and store connections
+        self.log_listener = setup_logging(self.log)
+        MainHTTPHandler.draining = False
+        MainHTTPHandler.store.connect()
+        if self.cache_snapshot and os.path.exists(self.cache_snapshot):
+            with open(self.cache_snapshot, "rb") as f:
+                loaded = interests_cache.load(MainHTTPHandler.codec.loads(f.read()))
+            logging.info("Interests cache loaded from snapshot with %d clients" % loaded)
+        else:
+            MainHTTPHandler.warmup = Warmup(MainHTTPHandler.store, self.hot_keys, self.warm_timeout).start()
+        logging.info("Worker %d started with %s codec" % (os.getpid(), MainHTTPHandler.codec.name))
+
+    def handover(self):
+        MainHTTPHandler.draining = True
+        if self.cache_snapshot:
+            # written aside and renamed, so that successors never read a partial snapshot
+            partial = f"{self.cache_snapshot}.{os.getpid()}"
+            with open(partial, "wb") as f:
+                f.write(MainHTTPHandler.codec.dumps(interests_cache.snapshot()))
+            os.replace(partial, self.cache_snapshot)
+
+    def stop(self):
+        # connections accepted before the server stopped are served until their current responses are sent,
+        # including those still reading headers or waiting for admission; idle persistent ones are closed at once
+        deadline = time.monotonic() + self.drain_timeout
+        while MainHTTPHandler.close_idle_connections() and time.monotonic() < deadline:
+            time.sleep(0.01)
+        logging.info("Worker %d stopped" % os.getpid())
+        MainHTTPHandler.store.disconnect()
+        self.log_listener.stop()
+
+
+def main(args: list[str] | None = None):
+    """
+    Serve the API with the command-line options in `args` (default: sys.argv[1:]) until the workers are stopped.
+    """
+    from access_log import setup_logging
+    from embedded_store import EmbeddedStore
+    from shm_cache import SHARED_CACHE_SLOTS, SharedScoreCache
+
+    op = OptionParser(usage="%prog [options], or %prog validate|token --help")
+    op.add_option("-p", "--port", action="store", type=int, default=8080)
+    op.add_option("-l", "--log", action="store", default=None)
+    op.add_option("--json-codec", action="store", default=None, choices=available_codecs(),
+                  help="JSON library for request/response bodies, the fastest installed one by default")
+    op.add_option("--keepalive-timeout", action="store", type=float, default=KEEP_ALIVE_TIMEOUT,
+                  help="seconds an idle persistent connection is kept open")
+    op.add_option("--keepalive-max", action="store", type=int, default=KEEP_ALIVE_MAX_REQUESTS,
+                  help="requests served over one connection before it is closed")
+    op.add_option("--storage-host", action="store", default="localhost")
+    op.add_option("--storage-port", action="store", type=int, default=6379)
+    op.add_option("--storage-nodes", action="store", default=None,
+                  help="comma-separated host:port list of Redis nodes to shard keys over, instead of a single node")
+    op.add_option("--storage-path", action="store", default=None,
+                  help="SQLite database file to keep the store in, instead of Redis")
+    op.add_option("--store-budget", action="store", type=float, default=STORE_BUDGET,
+                  help="seconds a request may spend waiting on the store")
+    op.add_option("--store-failures", action="store", type=int, default=5,
+                  help="consecutive store failures that open the circuit breaker")
+    op.add_option("--store-reset", action="store", type=float, default=5.,
+                  help="seconds the circuit breaker stays open before a probe request")
+    op.add_option("--log-body-sample", action="store", type=float, default=BODY_SAMPLE_RATE,
+                  help="share of requests whose raw body is logged")
+    op.add_option("--max-concurrency", action="store", type=int, default=MAX_CONCURRENCY,
+                  help="requests processed at once, others wait in the admission queue")
+    op.add_option("--queue-size", action="store", type=int, default=QUEUE_SIZE,
+                  help="requests waiting for processing; when it is full, new ones get 503 at once")
+    op.add_option("--queue-timeout", action="store", type=float, default=QUEUE_TIMEOUT,
+                  help="seconds a request may wait for processing before it gets 503")
+    op.add_option("--workers", action="store", type=int, default=1,
+                  help="processes accepting connections on the same socket and sharing a score cache; "
+                       "SIGHUP replaces them without dropping requests")
+    op.add_option("--drain-timeout", action="store", type=float, default=DRAIN_TIMEOUT,
+                  help="seconds a stopping worker waits for its in-flight requests")
+    op.add_option("--cache-snapshot", action="store", default=None,
+                  help="file the interests cache is handed over through to new workers on reload")
+    op.add_option("--shared-cache-slots", action="store", type=int, default=SHARED_CACHE_SLOTS,
+                  help="entries of the score cache shared by workers")
+    op.add_option("--data-version", action="store", default=MainHTTPHandler.data_version,
+                  help="version of the stored data included in ETags; change it to invalidate clients' copies")
+    op.add_option("--gzip-min-size", action="store", type=int, default=GZIP_MIN_SIZE,
+                  help="bytes from which responses are gzip-compressed for clients accepting it")
+    op.add_option("--warm-interests", action="store", type=int, default=100_000,
+                  help="hot keys (client interests and scores) loaded into local caches at startup")
+    op.add_option("--warm-keys", action="store", default=None,
+                  help="file with hot keys, one per line, hottest first; "
+                       "by default they are sampled from request bodies in the access log, or scanned from the store")
+    op.add_option("--warm-timeout", action="store", type=float, default=WARMUP_TIMEOUT,
+                  help="seconds after which /ready reports ready even if the warm-up has not finished")
+    op.add_option("--capture", action="store", default=None,
+                  help="file to record sampled requests to, for replay.py")
+    op.add_option("--capture-sample", action="store", type=float, default=CAPTURE_SAMPLE_RATE,
+                  help="share of requests recorded to the capture file")
+    (opts, args) = op.parse_args(args)
+    MainHTTPHandler.body_sample_rate = opts.log_body_sample
+    MainHTTPHandler.codec = get_codec(opts.json_codec)
+    if opts.storage_path:
+        MainHTTPHandler.store = EmbeddedStore(opts.storage_path)
+    elif opts.storage_nodes:
+        MainHTTPHandler.store = ShardedStore.from_addresses(
+            opts.storage_nodes.split(","), lambda: CircuitBreaker(opts.store_failures, opts.store_reset))
+    else:
+        MainHTTPHandler.store = Store(opts.storage_host, opts.storage_port,
+                                      breaker=CircuitBreaker(opts.store_failures, opts.store_reset))
+    MainHTTPHandler.store_budget = opts.store_budget
+    MainHTTPHandler.data_version = opts.data_version
+    MainHTTPHandler.gzip_min_size = opts.gzip_min_size
+    MainHTTPHandler.admission = AdmissionController(opts.max_concurrency, opts.queue_size, opts.queue_timeout)
+    MainHTTPHandler.timeout = opts.keepalive_timeout
+    MainHTTPHandler.max_requests = opts.keepalive_max
+    if opts.capture:
+        MainHTTPHandler.capture = TrafficCapture(opts.capture, opts.capture_sample)
+    # a persistent connection occupies its thread until it goes idle, so connections are served concurrently
+    server = ThreadingHTTPServer(("localhost", opts.port), MainHTTPHandler)
+    # scores cached by workers are kept across reloads, since the segment belongs to the supervisor
+    scoring.shared_scores = SharedScoreCache(opts.shared_cache_slots)
+    log_listener = setup_logging(opts.log)
+    logging.info("Starting server at %s with %d workers" % (opts.port, opts.workers))
+    worker = ServerWorker(opts.log, opts.warm_interests, opts.warm_keys, opts.warm_timeout,
+                          opts.cache_snapshot, opts.drain_timeout)
+    try:
+        Supervisor(server, opts.workers, worker).run()
+    finally:
+        server.server_close()
+        scoring.shared_scores.close()
+        scoring.shared_scores.unlink()
+        if MainHTTPHandler.capture:
+            MainHTTPHandler.capture.close()
+        log_listener.stop()
@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Offline validation of JSON lines files of method requests, e.g. daily partner uploads.
+
+The file is read in blocks of whole lines that worker processes validate with the request classes of api.py, without
+authentication. Valid records are written to one file as they are; invalid ones go to another as JSON lines with
+the line number and the error. Blocks are processed in parallel but written in the order of the input, and only
+a few blocks per process are in flight, so memory does not grow with the file.
+
+    python bulk_validate.py partner-2026-10-19.jsonl -o valid.jsonl -e invalid.jsonl --processes 8
+"""
+import collections
+import contextlib
+import json
+import multiprocessing
+import os
+import sys
+import time
+from optparse import OptionParser
+
+import api
+from json_codec import get_codec
+
+BLOCK_SIZE = 4 << 20  # bytes of input validated by one task
+BLOCKS_IN_FLIGHT = 2  # blocks per worker process that are read ahead of the writer
+INVALID_JSON = "Invalid JSON"
+UNEXPECTED_ERROR = "Unexpected error"
+
+codec = get_codec()
+
+
+def read_blocks(f, block_size: int = BLOCK_SIZE):
+    """
+    Blocks of whole lines of a binary file, each with the number of its first line.
+    """
+    line_number = 1
+    tail = b""
+    while True:
+        data = f.read(block_size)
+        if not data:
+            break
+        data = tail + data
+        end = data.rfind(b"\n") + 1
+        if not end:
+            tail = data
+            continue
+        block, tail = data[:end], data[end:]
+        yield line_number, block
+        line_number += block.count(b"\n")
+    if tail:
+        yield line_number, tail
+
+
+def validate_block(line_number: int, block: bytes) -> tuple[int, bytes, bytes, dict]:
+    """
+    Validate the records of a block. Returns the number of records, valid lines, invalid records and the numbers
+    of every error.
+    """
+    records = 0
+    valid = []
+    invalid = []
+    errors = collections.Counter()
+    for line in block.split(b"\n"):
+        if line.strip():
+            records += 1
+            try:
+                api.validate_request(codec.loads(line))
+            except api.ValidationError as e:
+                error = str(e)
+            except ValueError:
+                error = INVALID_JSON
+            except Exception as e:
+                # one broken record must not stop the rest of the file
+                error = f"{UNEXPECTED_ERROR}: {type(e).__name__}: {e}"
+            else:
+                valid.append(line + b"\n")
+                line_number += 1
+                continue
+            errors[error] += 1
+            invalid.append(codec.dumps({"line": line_number, "error": error,
+                                        "record": line.decode("utf-8", "replace")}) + b"\n")
+        line_number += 1
+    return records, b"".join(valid), b"".join(invalid), errors
+
+
+def _validate_in_pool(blocks, processes: int):
+    pending = collections.deque()
+    with multiprocessing.Pool(processes) as pool:
+        for block in blocks:
+            pending.append(pool.apply_async(validate_block, block))
+            if len(pending) >= processes * BLOCKS_IN_FLIGHT:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+
+
+def validate_file(path: str, valid_output: str | None = None, invalid_output: str | None = None,
+                  processes: int = 1, block_size: int = BLOCK_SIZE) -> dict:
+    """
+    Validate a JSON lines file of method requests and write valid and invalid records to separate files.
+
+    Args:
+        path: str, file to validate
+        valid_output: str, file valid records are written to as they are (default: not written)
+        invalid_output: str, file invalid records are written to as JSON lines with "line", "error" and "record"
+                        (default: not written)
+        processes: int, worker processes; 1 validates in the calling process (default: 1)
+        block_size: int, bytes of input validated by one task (default: BLOCK_SIZE)
+    """
+    started = time.monotonic()
+    records = valid_records = 0
+    errors = collections.Counter()
+    with contextlib.ExitStack() as stack:
+        source = stack.enter_context(open(path, "rb"))
+        valid_file = stack.enter_context(open(valid_output, "wb")) if valid_output else None
+        invalid_file = stack.enter_context(open(invalid_output, "wb")) if invalid_output else None
+
+        blocks = read_blocks(source, block_size)
+        if processes > 1:
+            results = _validate_in_pool(blocks, processes)
+        else:
+            results = (validate_block(*block) for block in blocks)
+        for block_records, valid, invalid, block_errors in results:
+            records += block_records
+            valid_records += valid.count(b"\n")
+            errors.update(block_errors)
+            if valid_file:
+                valid_file.write(valid)
+            if invalid_file:
+                invalid_file.write(invalid)
+
+    elapsed = time.monotonic() - started
+    return {
+        "records": records,
+        "valid": valid_records,
+        "invalid": records - valid_records,
+        "errors": dict(errors.most_common()),
+        "seconds": round(elapsed, 3),
+        "records_per_second": round(records / elapsed, 1) if elapsed else 0.,
+    }
+
+
+if __name__ == "__main__":
+    op = OptionParser(usage="%prog [options] FILE")
+    op.add_option("-o", "--valid-output", action="store", default=None, help="file to write valid records to")
+    op.add_option("-e", "--invalid-output", action="store", default=None,
+                  help="file to write invalid records to, with their line numbers and errors")
+    op.add_option("-j", "--processes", action="store", type=int, default=os.cpu_count(),
+                  help="worker processes validating blocks of the file")
+    op.add_option("--block-size", action="store", type=int, default=BLOCK_SIZE,
+                  help="bytes of input validated by one task")
+    (opts, args) = op.parse_args()
+    if len(args) != 1:
+        op.error("a request file is required")
+
+    report = validate_file(args[0], opts.valid_output, opts.invalid_output, opts.processes, opts.block_size)
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    sys.exit(0 if report["valid"] == report["records"] else 1)
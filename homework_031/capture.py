@@ -0,0 +1,37 @@
+import json
+import os
+import random
+
+CAPTURE_SAMPLE_RATE = 0.01  # share of requests recorded to the capture file
+
+
+class TrafficCapture:
+    """
+    JSON lines file of sampled requests for replay.py: wall-clock time the request arrived, path, raw body, response
+    code and time in seconds the server spent on it.
+
+    Every record is appended with a single write to a file opened with O_APPEND, so worker processes forked after
+    the file is opened share it without locks, and the request thread never waits on a buffer flush.
+
+    Args:
+        path: str, file to append records to
+        sample_rate: float, share of requests recorded (default: CAPTURE_SAMPLE_RATE)
+    """
+
+    def __init__(self, path: str, sample_rate: float = CAPTURE_SAMPLE_RATE):
+        self.path = path
+        self.sample_rate = sample_rate
+        self.recorded = 0
+        self._fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+
+    def sampled(self) -> bool:
+        return self.sample_rate >= 1. or random.random() < self.sample_rate
+
+    def record(self, arrived: float, path: str, body: bytes, code: int, elapsed: float):
+        line = json.dumps({"ts": round(arrived, 6), "path": path, "body": body.decode("utf-8", "replace"),
+                           "code": code, "elapsed": round(elapsed, 6)}, ensure_ascii=False)
+        os.write(self._fd, line.encode("utf-8") + b"\n")
+        self.recorded += 1
+
+    def close(self):
+        os.close(self._fd)
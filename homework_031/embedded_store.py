@@ -0,0 +1,286 @@
+import contextlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+from store import Deadline, StoreError, StoreSession, StoreTimeout
+
+logger = logging.getLogger('store')
+
+SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS kv (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL) WITHOUT ROWID",
+    "CREATE INDEX IF NOT EXISTS kv_expires_at ON kv (expires_at) WHERE expires_at IS NOT NULL",
+)
+NOT_EXPIRED = "(expires_at IS NULL OR expires_at > ?)"
+MAX_VARIABLES = 500  # keys bound to a single SELECT ... IN (...)
+
+
+class EmbeddedStore:
+    """
+    Store kept in a local SQLite database in WAL mode, with the interface of store.Store and no server to run.
+    Readers do not block the writer and each other, the database file is memory-mapped. Expired cache entries are
+    never returned and are deleted by a background sweeper thread.
+
+    Args:
+        path: str, database file, created if missing
+        timeout: float, time in seconds to wait for a locked database (default: 3 seconds)
+        sweep_interval: float, time in seconds between deletions of expired entries (default: 1 second)
+        mmap_size: int, bytes of the database file to memory-map (default: 256 MiB)
+    """
+
+    path: str
+    timeout: float
+    sweep_interval: float
+    mmap_size: int
+    stats: dict  # counters of store calls: calls, failures, timeouts, expired, wait_seconds
+
+    def __init__(self, path: str, timeout: float = 3., sweep_interval: float = 1., mmap_size: int = 256 << 20):
+        self.path = path
+        self.timeout = timeout
+        self.sweep_interval = sweep_interval
+        self.mmap_size = mmap_size
+        self.stats = {"calls": 0, "failures": 0, "timeouts": 0, "expired": 0, "wait_seconds": 0.}
+
+        self._stats_lock = threading.Lock()
+        self._pool = []  # idle connections, shared by request threads
+        self._pool_lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._sweeper = None
+
+    def connect(self, timeout: float = 10.):
+        """
+        Create the database and start the sweeper thread.
+
+        Args:
+            timeout: float, time in seconds to wait for a locked database while creating it (default: 10 seconds)
+        """
+        connection = sqlite3.connect(self.path, timeout=timeout, isolation_level=None, check_same_thread=False)
+        connection.execute("PRAGMA journal_mode=WAL")
+        for statement in SCHEMA:
+            connection.execute(statement)
+        connection.close()
+
+        self._stopped.clear()
+        self._sweeper = threading.Thread(target=self._sweep_forever, name="store-sweeper", daemon=True)
+        self._sweeper.start()
+        logger.info("Opened embedded store at %s", self.path)
+
+    def disconnect(self):
+        """
+        Stop the sweeper thread and close all connections.
+        """
+        self._stopped.set()
+        if self._sweeper is not None:
+            self._sweeper.join()
+            self._sweeper = None
+        with self._pool_lock:
+            for connection in self._pool:
+                connection.close()
+            self._pool.clear()
+        logger.info("Closed embedded store at %s", self.path)
+
+    def session(self, deadline: Deadline) -> StoreSession:
+        """
+        Bind store operations of a single request to its deadline.
+        """
+        return StoreSession(self, deadline)
+
+    def _count(self, name: str, value=1):
+        with self._stats_lock:
+            self.stats[name] += value
+
+    def _open(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None, check_same_thread=False)
+        connection.execute("PRAGMA synchronous=NORMAL")
+        connection.execute(f"PRAGMA mmap_size={int(self.mmap_size)}")
+        return connection
+
+    @contextlib.contextmanager
+    def _connection(self):
+        with self._pool_lock:
+            connection = self._pool.pop() if self._pool else None
+        if connection is None:
+            connection = self._open()
+        try:
+            yield connection
+        finally:
+            with self._pool_lock:
+                self._pool.append(connection)
+
+    def _call(self, action: str, function, deadline: Optional[Deadline] = None):
+        if deadline is not None and deadline.expired:
+            self._count("timeouts")
+            raise StoreTimeout(f"Request deadline exceeded before calling embedded store at {self.path}")
+
+        started = time.monotonic()
+        self._count("calls")
+        try:
+            with self._connection() as connection:
+                return function(connection)
+        except sqlite3.Error as e:
+            self._count("failures")
+            raise StoreError(f"An error occurred while trying to {action} embedded store at {self.path}") from e
+        finally:
+            waited = time.monotonic() - started
+            self._count("wait_seconds", waited)
+            if deadline is not None:
+                deadline.store_wait += waited
+
+    def _select(self, connection: sqlite3.Connection, keys: list) -> list:
+        values = {}
+        now = time.time()
+        for start in range(0, len(keys), MAX_VARIABLES):
+            chunk = keys[start:start + MAX_VARIABLES]
+            rows = connection.execute(
+                f"SELECT key, value FROM kv WHERE key IN ({','.join('?' * len(chunk))}) AND {NOT_EXPIRED}",
+                (*chunk, now),
+            )
+            values.update(rows)
+        return [json.loads(values[key]) if key in values else None for key in keys]
+
+    def _write(self, connection: sqlite3.Connection, mapping: dict, ttl):
+        expires_at = time.time() + ttl if ttl else None
+        with connection:
+            connection.execute("BEGIN IMMEDIATE")
+            connection.executemany(
+                "INSERT OR REPLACE INTO kv (key, value, expires_at) VALUES (?, ?, ?)",
+                ((key, json.dumps(value), expires_at) for key, value in mapping.items()),
+            )
+
+    def cache_get(self, key: str, deadline: Optional[Deadline] = None):
+        """
+        Read value from the cache by key. If the database fails, returns None.
+
+        Args:
+            key: str, key for resource
+            deadline: Deadline, time budget of the calling request (default: no deadline)
+
+        Returns:
+            None if no value is stored for key or it has expired, decoded value otherwise
+        """
+        return self.cache_get_many([key], deadline)[0]
+
+    def cache_set(self, key, value, ttl, deadline: Optional[Deadline] = None):
+        """
+        Write JSON-encoded value to the cache by key with TTL. If the database fails, does nothing.
+
+        Args:
+            key: str, key for resource
+            value: value to store
+            ttl: time-to-live in seconds
+            deadline: Deadline, time budget of the calling request (default: no deadline)
+        """
+        self.cache_set_many({key: value}, ttl, deadline)
+
+    def cache_get_many(self, keys: list, deadline: Optional[Deadline] = None) -> list:
+        """
+        Read many values from the cache with a single query. If the database fails, returns Nones.
+
+        Args:
+            keys: list of str, keys for resources
+            deadline: Deadline, time budget of the calling request (default: no deadline)
+
+        Returns:
+            list of decoded values in order of keys, None for keys without a value
+        """
+        if not keys:
+            return []
+        try:
+            return self._call('read from', lambda connection: self._select(connection, keys), deadline)
+        except StoreError as e:
+            logger.warning("Failed to read %d key(s) from embedded store at %s: %s", len(keys), self.path,
+                           type(e).__name__)
+            return [None] * len(keys)
+
+    def cache_set_many(self, mapping: dict, ttl, deadline: Optional[Deadline] = None):
+        """
+        Write many JSON-encoded values to the cache with TTL in a single transaction. If the database fails,
+        does nothing.
+
+        Args:
+            mapping: dict, values by keys
+            ttl: time-to-live in seconds
+            deadline: Deadline, time budget of the calling request (default: no deadline)
+        """
+        if not mapping:
+            return
+        try:
+            self._call('write to', lambda connection: self._write(connection, mapping, ttl), deadline)
+        except StoreError as e:
+            logger.warning("Failed to write %d key(s) to embedded store at %s: %s", len(mapping), self.path,
+                           type(e).__name__)
+
+    def get(self, key, deadline: Optional[Deadline] = None):
+        """
+        Read value from persistent storage by key.
+
+        Args:
+            key: str, key for resource
+            deadline: Deadline, time budget of the calling request (default: no deadline)
+
+        Raises:
+            StoreError if the database fails, StoreTimeout if the deadline is exceeded
+
+        Returns:
+            None if no value is stored for key, decoded value otherwise
+        """
+        return self.get_many([key], deadline)[0]
+
+    def get_many(self, keys: list, deadline: Optional[Deadline] = None) -> list:
+        """
+        Read many values from persistent storage with a single query.
+
+        Args:
+            keys: list of str, keys for resources
+            deadline: Deadline, time budget of the calling request (default: no deadline)
+
+        Raises:
+            StoreError if the database fails, StoreTimeout if the deadline is exceeded
+
+        Returns:
+            list of decoded values in order of keys, None for keys without a value
+        """
+        if not keys:
+            return []
+        return self._call('read from', lambda connection: self._select(connection, keys), deadline)
+
+    def set_many(self, mapping: dict):
+        """
+        Write many JSON-encoded values to persistent storage, without expiration.
+
+        Raises:
+            StoreError if the database fails
+        """
+        if mapping:
+            self._call('write to', lambda connection: self._write(connection, mapping, None))
+
+    def scan(self, pattern: str, limit: int) -> list[str]:
+        """
+        Keys matching the glob-style pattern, at most `limit` of them.
+
+        Raises:
+            StoreError if the database fails
+        """
+        return self._call('scan', lambda connection: [key for key, in connection.execute(
+            f"SELECT key FROM kv WHERE key GLOB ? AND {NOT_EXPIRED} LIMIT ?", (pattern, time.time(), limit)
+        )])
+
+    def sweep(self) -> int:
+        """
+        Delete expired entries. Returns number of deleted entries.
+        """
+        deleted = self._call('sweep', lambda connection: connection.execute(
+            "DELETE FROM kv WHERE expires_at <= ?", (time.time(),)
+        ).rowcount)
+        self._count("expired", deleted)
+        return deleted
+
+    def _sweep_forever(self):
+        while not self._stopped.wait(self.sweep_interval):
+            try:
+                self.sweep()
+            except StoreError:
+                logger.exception("An error occurred while trying to delete expired entries at %s", self.path)
@@ -0,0 +1,88 @@
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+
+class JsonCodec:
+    """
+    Standard library codec. Parses request bodies straight from bytes and returns response bodies as bytes,
+    so the HTTP handler never has to decode/encode strings itself.
+    """
+    name = "json"
+
+    def loads(self, data: bytes):
+        return json.loads(data)
+
+    def dumps(self, obj) -> bytes:
+        return json.dumps(obj).encode('utf-8')
+
+    def canonical(self, obj) -> bytes:
+        """
+        Same bytes for equal objects regardless of key order, e.g. to hash requests.
+        """
+        return json.dumps(obj, sort_keys=True, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+
+
+class UjsonCodec(JsonCodec):
+    name = "ujson"
+
+    def loads(self, data: bytes):
+        return ujson.loads(data)
+
+    def dumps(self, obj) -> bytes:
+        return ujson.dumps(obj, ensure_ascii=False).encode('utf-8')
+
+    def canonical(self, obj) -> bytes:
+        return ujson.dumps(obj, ensure_ascii=False, sort_keys=True).encode('utf-8')
+
+
+class OrjsonCodec(JsonCodec):
+    name = "orjson"
+
+    def loads(self, data: bytes):
+        return orjson.loads(data)
+
+    def dumps(self, obj) -> bytes:
+        # clients_interests responses are keyed by integer client ids
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+
+    def canonical(self, obj) -> bytes:
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SORT_KEYS)
+
+
+CODECS = {
+    JsonCodec.name: (JsonCodec, json),
+    UjsonCodec.name: (UjsonCodec, ujson),
+    OrjsonCodec.name: (OrjsonCodec, orjson),
+}
+# fastest first
+PREFERRED_CODECS = (OrjsonCodec.name, UjsonCodec.name, JsonCodec.name)
+
+
+def available_codecs() -> list[str]:
+    return [name for name in PREFERRED_CODECS if CODECS[name][1] is not None]
+
+
+def get_codec(name: str | None = None) -> JsonCodec:
+    """
+    Return codec by name or the fastest installed one if name is not given.
+
+    Raises:
+        ValueError if codec is unknown or its library is not installed
+    """
+    if name is None:
+        name = available_codecs()[0]
+    if name not in CODECS:
+        raise ValueError(f"Unknown JSON codec {name}, expected one of {', '.join(CODECS)}")
+    codec_class, module = CODECS[name]
+    if module is None:
+        raise ValueError(f"JSON codec {name} is not installed")
+    return codec_class()
@@ -0,0 +1,246 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Load generator for the scoring API.
+
+Sends a mix of online_score and clients_interests requests with valid tokens over persistent connections and reports
+throughput and latency percentiles. Without --url a local api.py server is started in-process with a fake store,
+or with an embedded SQLite store given --store-path.
+
+    python loadtest.py --concurrency 8 --duration 10 --interests-share 0.3 --store-latency 0.002 -o result.json
+"""
+import datetime
+import hashlib
+import http.client
+import json
+import logging
+import random
+import threading
+import time
+import urllib.parse
+from collections import Counter
+from optparse import OptionParser
+
+import api
+import api_server
+import scoring
+from embedded_store import EmbeddedStore
+
+ACCOUNT = "horns&hoofs"
+LOGIN = "h&f"
+
+
+class FakeStore:
+    """
+    In-memory store with the interface of store.Store and an injected latency for every call.
+
+    Args:
+        latency: float, time in seconds every call sleeps (default: 0)
+        clients: int, number of clients with interests under i:<cid> keys (default: 1000)
+    """
+
+    def __init__(self, latency: float = 0., clients: int = 1000):
+        self.latency = latency
+        self.data = {f"i:{cid}": random.sample(scoring.INTERESTS, 2) for cid in range(clients)}
+        self._lock = threading.Lock()
+
+    def _wait(self):
+        if self.latency:
+            time.sleep(self.latency)
+
+    def get(self, key, deadline=None):
+        self._wait()
+        return self.data.get(key)
+
+    def get_many(self, keys, deadline=None):
+        self._wait()
+        return [self.data.get(key) for key in keys]
+
+    def cache_get(self, key, deadline=None):
+        self._wait()
+        return self.data.get(key)
+
+    def cache_set(self, key, value, ttl, deadline=None):
+        self._wait()
+        with self._lock:
+            self.data[key] = value
+
+    def cache_get_many(self, keys, deadline=None):
+        self._wait()
+        return [self.data.get(key) for key in keys]
+
+    def cache_set_many(self, mapping, ttl, deadline=None):
+        self._wait()
+        with self._lock:
+            self.data.update(mapping)
+
+
+def user_token(account: str, login: str) -> str:
+    return hashlib.sha512((account + login + api.SALT).encode('utf-8')).hexdigest()
+
+
+def random_score_arguments() -> dict:
+    arguments = {
+        "phone": "7" + "".join(random.choices("0123456789", k=10)),
+        "email": f"user{random.randrange(10 ** 6)}@otus.ru",
+    }
+    if random.random() < 0.5:
+        arguments.update({"first_name": "Ivan", "last_name": "Petrov"})
+    if random.random() < 0.5:
+        birthday = datetime.date(random.randint(1960, 2005), random.randint(1, 12), random.randint(1, 28))
+        arguments.update({"birthday": birthday.strftime("%d.%m.%Y"), "gender": random.choice(list(api.GENDERS))})
+    return arguments
+
+
+def build_requests(count: int, interests_share: float, max_clients: int, clients: int) -> list[tuple[str, bytes]]:
+    """
+    Pre-encoded request bodies, so that the generator spends its time on sending them.
+    """
+    token = user_token(ACCOUNT, LOGIN)
+    requests = []
+    for _ in range(count):
+        if random.random() < interests_share:
+            method = "clients_interests"
+            arguments = {"client_ids": random.sample(range(clients), random.randint(1, max_clients))}
+        else:
+            method = "online_score"
+            arguments = random_score_arguments()
+        body = {"account": ACCOUNT, "login": LOGIN, "token": token, "method": method, "arguments": arguments}
+        requests.append((method, json.dumps(body).encode('utf-8')))
+    return requests
+
+
+def percentile(values: list[float], q: float) -> float:
+    if not values:
+        return 0.
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+class Worker(threading.Thread):
+    def __init__(self, host: str, port: int, path: str, requests: list, deadline: float):
+        super().__init__(daemon=True)
+        self.host, self.port, self.path = host, port, path
+        self.requests = requests
+        self.deadline = deadline
+        self.latencies = {}
+        self.codes = Counter()
+        self.errors = 0
+
+    def run(self):
+        connection = http.client.HTTPConnection(self.host, self.port, timeout=10)
+        headers = {"Content-Type": "application/json"}
+        while time.monotonic() < self.deadline:
+            method, body = random.choice(self.requests)
+            started = time.perf_counter()
+            try:
+                connection.request("POST", self.path, body=body, headers=headers)
+                response = connection.getresponse()
+                response.read()
+            except (OSError, http.client.HTTPException):
+                self.errors += 1
+                connection.close()
+                continue
+            self.latencies.setdefault(method, []).append(time.perf_counter() - started)
+            self.codes[response.status] += 1
+        connection.close()
+
+
+def run(url: str, concurrency: int, duration: float, requests: list) -> dict:
+    parsed = urllib.parse.urlsplit(url)
+    deadline = time.monotonic() + duration
+    workers = [Worker(parsed.hostname, parsed.port, parsed.path, requests, deadline) for _ in range(concurrency)]
+    started = time.monotonic()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.monotonic() - started
+
+    latencies = {}
+    for worker in workers:
+        for method, values in worker.latencies.items():
+            latencies.setdefault(method, []).extend(values)
+    latencies["all"] = [value for values in list(latencies.values()) for value in values]
+
+    result = {
+        "url": url,
+        "concurrency": concurrency,
+        "duration": round(elapsed, 3),
+        "requests": len(latencies["all"]),
+        "errors": sum(worker.errors for worker in workers),
+        "throughput": round(len(latencies["all"]) / elapsed, 1),
+        "codes": dict(sum((worker.codes for worker in workers), Counter())),
+        "latency_ms": {},
+    }
+    for method, values in latencies.items():
+        values.sort()
+        result["latency_ms"][method] = {
+            "count": len(values),
+            "p50": round(percentile(values, 0.50) * 1000, 3),
+            "p95": round(percentile(values, 0.95) * 1000, 3),
+            "p99": round(percentile(values, 0.99) * 1000, 3),
+        }
+    return result
+
+
+def start_local_server(store) -> api_server.ThreadingHTTPServer:
+    handler = type("LoadTestHandler", (api_server.MainHTTPHandler,), {
+        "store": store,
+        "body_sample_rate": 0.,
+    })
+    server = api_server.ThreadingHTTPServer(("localhost", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    op = OptionParser()
+    op.add_option("--url", action="store", default=None,
+                  help="API method URL, e.g. http://localhost:8080/method; a local server is started if not given")
+    op.add_option("-c", "--concurrency", action="store", type=int, default=4)
+    op.add_option("-d", "--duration", action="store", type=float, default=10., help="seconds")
+    op.add_option("--interests-share", action="store", type=float, default=0.3,
+                  help="share of clients_interests requests in the mix")
+    op.add_option("--max-clients", action="store", type=int, default=10,
+                  help="maximum client_ids in a clients_interests request")
+    op.add_option("--clients", action="store", type=int, default=1000, help="distinct client ids")
+    op.add_option("--store-latency", action="store", type=float, default=0.,
+                  help="seconds every fake store call sleeps (local server only)")
+    op.add_option("--store-path", action="store", default=None,
+                  help="SQLite database file of an embedded store to use instead of the fake one (local server only)")
+    op.add_option("--pool", action="store", type=int, default=10000, help="distinct request bodies to send")
+    op.add_option("-o", "--output", action="store", default=None, help="JSON file to save results to")
+    (opts, args) = op.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    server = None
+    url = opts.url
+    if url is None:
+        if opts.store_path:
+            store = EmbeddedStore(opts.store_path)
+            store.connect()
+            store.set_many(FakeStore(clients=opts.clients).data)
+        else:
+            store = FakeStore(opts.store_latency, opts.clients)
+        server = start_local_server(store)
+        url = "http://%s:%d/method" % server.server_address[:2]
+
+    result = run(url, opts.concurrency, opts.duration,
+                 build_requests(opts.pool, opts.interests_share, opts.max_clients, opts.clients))
+    result.update({
+        "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+        "interests_share": opts.interests_share,
+        "store_latency": opts.store_latency if server else None,
+        "store": type(server.RequestHandlerClass.store).__name__ if server else None,
+        "json_codec": api_server.MainHTTPHandler.codec.name if server else None,
+    })
+    print(json.dumps(result, indent=2))
+    if opts.output:
+        with open(opts.output, "w") as f:
+            json.dump(result, f, indent=2)
+
+    if server:
+        server.shutdown()
+        server.server_close()
+        if opts.store_path:
+            server.RequestHandlerClass.store.disconnect()
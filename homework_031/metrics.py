@@ -0,0 +1,136 @@
+import bisect
+import contextlib
+import threading
+import time
+
+# HDR-style buckets: every power of two between MIN_LATENCY and MAX_LATENCY is split into SUB_BUCKETS
+# log-linear sub-buckets, so the relative error of a quantile is bounded by 1 / SUB_BUCKETS
+MIN_LATENCY = 2 ** -17  # ~7.6 microseconds
+MAX_LATENCY = 2 ** 6  # 64 seconds
+SUB_BUCKETS = 4
+BUCKETS = tuple(
+    2 ** exponent * (1 + sub_bucket / SUB_BUCKETS)
+    for exponent in range(-17, 6)
+    for sub_bucket in range(SUB_BUCKETS)
+) + (MAX_LATENCY,)
+
+PHASES = ("queue", "parse", "validate", "auth", "handler", "serialize", "total")
+
+
+class Histogram:
+    """
+    Latency histogram with fixed log-linear buckets. Values above the last bucket are counted in +Inf.
+    """
+
+    def __init__(self, buckets: tuple = BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q: float) -> float:
+        """
+        Upper bound of the bucket holding the q-th quantile, 0 for an empty histogram.
+        """
+        if not self.count:
+            return 0.
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+
+@contextlib.contextmanager
+def timed(ctx: dict, phase: str):
+    """
+    Add time spent in the block to ctx["timings"][phase].
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings = ctx.setdefault("timings", {})
+        timings[phase] = timings.get(phase, 0.) + time.perf_counter() - started
+
+
+class Metrics:
+    """
+    In-process metrics of the API: latency histograms per (method, phase) and response counters per (method, code).
+    Rendered in Prometheus text exposition format.
+    """
+
+    def __init__(self):
+        self.histograms = {}
+        self.responses = {}
+        self._lock = threading.Lock()
+
+    def observe_request(self, method: str, code: int, timings: dict):
+        with self._lock:
+            for phase, value in timings.items():
+                histogram = self.histograms.get((method, phase))
+                if histogram is None:
+                    histogram = self.histograms[(method, phase)] = Histogram()
+                histogram.observe(value)
+            self.responses[(method, code)] = self.responses.get((method, code), 0) + 1
+
+    def render(self, store_stats: dict | None = None, admission_stats: dict | None = None) -> str:
+        lines = [
+            "# HELP api_request_phase_seconds Time spent in a phase of API request processing.",
+            "# TYPE api_request_phase_seconds histogram",
+        ]
+        with self._lock:
+            for (method, phase), histogram in sorted(self.histograms.items()):
+                labels = f'method="{method}",phase="{phase}"'
+                cumulative = 0
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    cumulative += count
+                    lines.append(f'api_request_phase_seconds_bucket{{{labels},le="{bound:.9g}"}} {cumulative}')
+                lines.append(f'api_request_phase_seconds_bucket{{{labels},le="+Inf"}} {histogram.count}')
+                lines.append(f'api_request_phase_seconds_sum{{{labels}}} {histogram.sum:.9g}')
+                lines.append(f'api_request_phase_seconds_count{{{labels}}} {histogram.count}')
+
+            lines += [
+                "# HELP api_responses_total Responses sent by the API.",
+                "# TYPE api_responses_total counter",
+            ]
+            for (method, code), count in sorted(self.responses.items()):
+                lines.append(f'api_responses_total{{method="{method}",code="{code}"}} {count}')
+
+        if store_stats:
+            lines += [
+                "# HELP api_store_total Store calls by outcome.",
+                "# TYPE api_store_total counter",
+            ]
+            for name, value in store_stats.items():
+                if name != "wait_seconds":
+                    lines.append(f'api_store_total{{outcome="{name}"}} {value}')
+            lines += [
+                "# HELP api_store_wait_seconds_total Time spent waiting on the store.",
+                "# TYPE api_store_wait_seconds_total counter",
+                f'api_store_wait_seconds_total {store_stats["wait_seconds"]:.9g}',
+            ]
+        if admission_stats:
+            lines += [
+                "# HELP api_admission_total Requests by admission outcome.",
+                "# TYPE api_admission_total counter",
+            ]
+            for name, value in admission_stats.items():
+                if name not in ("active", "waiting"):
+                    lines.append(f'api_admission_total{{outcome="{name}"}} {value}')
+            lines += [
+                "# HELP api_admission_active Requests being processed.",
+                "# TYPE api_admission_active gauge",
+                f'api_admission_active {admission_stats["active"]}',
+                "# HELP api_admission_waiting Requests waiting for a processing slot.",
+                "# TYPE api_admission_waiting gauge",
+                f'api_admission_waiting {admission_stats["waiting"]}',
+            ]
+        return "\n".join(lines) + "\n"
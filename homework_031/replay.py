@@ -0,0 +1,195 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Replay of requests recorded by api.py --capture.
+
+Sends the captured request bodies in their original order and at their original pace, or `--speed` times faster,
+and reports latency percentiles next to the ones recorded in production, response codes that differ from the
+recorded ones, and how late requests were sent against the schedule. Without --url a local api.py server is started
+in-process with a fake store. Admin tokens in the capture are only valid within the hour they were issued.
+
+    python api.py --capture capture.jsonl --capture-sample 0.05
+    python replay.py capture.jsonl --speed 4 --concurrency 16 -o result.json
+"""
+import datetime
+import http.client
+import json
+import logging
+import queue
+import threading
+import time
+import urllib.parse
+from collections import Counter
+from optparse import OptionParser
+
+import api
+from loadtest import FakeStore, percentile, start_local_server
+
+
+def read_capture(path: str) -> list[dict]:
+    """
+    Records of a capture file ordered by arrival time. Workers append to the file concurrently, so it is only
+    roughly ordered, and a record cut by a crash is skipped.
+    """
+    records = []
+    with open(path, "rb") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+                record["body"] = record["body"].encode("utf-8")
+            except (ValueError, KeyError, AttributeError):
+                continue
+            records.append(record)
+    records.sort(key=lambda record: record["ts"])
+    return records
+
+
+def request_method(body: bytes) -> str:
+    try:
+        method = json.loads(body).get("method")
+    except (ValueError, AttributeError):
+        return "unknown"
+    return method if method in api.METHODS else "unknown"
+
+
+class Sender(threading.Thread):
+    """
+    Takes records from a queue shared with other senders in capture order, waits for the time each one is due and
+    sends it over a persistent connection.
+    """
+
+    def __init__(self, host: str, port: int, records: queue.Queue, started: float, speed: float):
+        super().__init__(daemon=True)
+        self.host, self.port = host, port
+        self.records = records
+        self.started = started
+        self.speed = speed
+        self.latencies = {}
+        self.lags = []
+        self.codes = Counter()
+        self.mismatches = Counter()
+        self.errors = 0
+
+    def run(self):
+        connection = http.client.HTTPConnection(self.host, self.port, timeout=10)
+        headers = {"Content-Type": "application/json"}
+        while True:
+            try:
+                offset, method, record = self.records.get_nowait()
+            except queue.Empty:
+                break
+            due = self.started + offset / self.speed if self.speed else time.monotonic()
+            delay = due - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            sent = time.monotonic()
+            self.lags.append(sent - due)
+            try:
+                connection.request("POST", record["path"], body=record["body"], headers=headers)
+                response = connection.getresponse()
+                response.read()
+            except (OSError, http.client.HTTPException):
+                self.errors += 1
+                connection.close()
+                continue
+            self.latencies.setdefault(method, []).append(time.monotonic() - sent)
+            self.codes[response.status] += 1
+            if response.status != record.get("code"):
+                self.mismatches[f"{record.get('code')}->{response.status}"] += 1
+        connection.close()
+
+
+def summary(values: list[float]) -> dict:
+    values = sorted(values)
+    return {
+        "count": len(values),
+        "p50": round(percentile(values, 0.50) * 1000, 3),
+        "p95": round(percentile(values, 0.95) * 1000, 3),
+        "p99": round(percentile(values, 0.99) * 1000, 3),
+    }
+
+
+def replay(url: str, records: list[dict], speed: float = 1., concurrency: int = 16) -> dict:
+    """
+    Send the captured records to `url` keeping the gaps between their arrival times divided by `speed`;
+    with speed 0 they are sent as fast as the senders can.
+    """
+    parsed = urllib.parse.urlsplit(url)
+    pending = queue.Queue()
+    recorded = {}
+    first = records[0]["ts"] if records else 0.
+    for record in records:
+        method = request_method(record["body"])
+        pending.put((record["ts"] - first, method, record))
+        recorded.setdefault(method, []).append(record.get("elapsed", 0.))
+
+    started = time.monotonic()
+    senders = [Sender(parsed.hostname, parsed.port, pending, started, speed) for _ in range(concurrency)]
+    for sender in senders:
+        sender.start()
+    for sender in senders:
+        sender.join()
+    elapsed = time.monotonic() - started
+
+    latencies = {}
+    for sender in senders:
+        for method, values in sender.latencies.items():
+            latencies.setdefault(method, []).extend(values)
+    latencies["all"] = [value for values in list(latencies.values()) for value in values]
+    recorded["all"] = [value for values in list(recorded.values()) for value in values]
+
+    return {
+        "url": url,
+        "speed": speed,
+        "concurrency": concurrency,
+        "captured": len(records),
+        "captured_duration": round(records[-1]["ts"] - first, 3) if records else 0.,
+        "duration": round(elapsed, 3),
+        "requests": len(latencies["all"]),
+        "errors": sum(sender.errors for sender in senders),
+        "throughput": round(len(latencies["all"]) / elapsed, 1) if elapsed else 0.,
+        "codes": dict(sum((sender.codes for sender in senders), Counter())),
+        "code_mismatches": dict(sum((sender.mismatches for sender in senders), Counter())),
+        "lag_ms": summary([lag for sender in senders for lag in sender.lags]),
+        "latency_ms": {method: summary(values) for method, values in latencies.items()},
+        "recorded_latency_ms": {method: summary(values) for method, values in recorded.items()},
+    }
+
+
+if __name__ == "__main__":
+    op = OptionParser(usage="%prog [options] CAPTURE_FILE")
+    op.add_option("--url", action="store", default=None,
+                  help="base URL of the API, e.g. http://localhost:8080; a local server is started if not given")
+    op.add_option("-c", "--concurrency", action="store", type=int, default=16,
+                  help="connections; requests are sent late when all of them are busy")
+    op.add_option("-s", "--speed", action="store", type=float, default=1.,
+                  help="replay speed relative to the capture, 0 to send as fast as possible")
+    op.add_option("--store-latency", action="store", type=float, default=0.,
+                  help="seconds every fake store call sleeps (local server only)")
+    op.add_option("--clients", action="store", type=int, default=1000, help="clients with interests in the fake store")
+    op.add_option("-o", "--output", action="store", default=None, help="JSON file to save results to")
+    (opts, args) = op.parse_args()
+    if len(args) != 1:
+        op.error("a capture file is required")
+    logging.basicConfig(level=logging.WARNING)
+
+    server = None
+    url = opts.url
+    if url is None:
+        server = start_local_server(FakeStore(opts.store_latency, opts.clients))
+        url = "http://%s:%d" % server.server_address[:2]
+
+    result = replay(url.rstrip("/"), read_capture(args[0]), opts.speed, opts.concurrency)
+    result.update({
+        "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+        "capture": args[0],
+        "store_latency": opts.store_latency if server else None,
+    })
+    print(json.dumps(result, indent=2))
+    if opts.output:
+        with open(opts.output, "w") as f:
+            json.dump(result, f, indent=2)
+
+    if server:
+        server.shutdown()
+        server.server_close()
@@ -1,19 +1,312 @@
-import random
+import datetime
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+# NumPy is imported with the first bulk call: it takes longer to import than the rest of the API;
+# None if it is not installed
+np = NotImplemented
+
+PHONE_WEIGHT = 1.5
+EMAIL_WEIGHT = 1.5
+BIRTHDAY_GENDER_WEIGHT = 1.5
+NAME_WEIGHT = 0.5
+SCORE_TTL = 60 * 60  # seconds
+
+INTERESTS = ("cars", "pets", "travel", "hi-tech", "sport", "music", "books", "tv", "cinema", "geek", "otus")
+_ALL_INTERESTS = (1 << len(INTERESTS)) - 1
+INTEREST_IDS = {interest: interest_id for interest_id, interest in enumerate(INTERESTS)}
+# interests of every possible bitset, so that decoding is a single lookup
+_DECODED_INTERESTS = tuple(
+    tuple(interest for interest_id, interest in enumerate(INTERESTS) if mask >> interest_id & 1)
+    for mask in range(_ALL_INTERESTS + 1)
+)
+INTERESTS_CACHE_SIZE = 1_000_000  # clients
+INTERESTS_CACHE_TTL = 5 * 60  # seconds
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with the same key: the first caller runs the function, the others wait for it and
+    get its result (or its exception) instead of running the function again.
+    """
+
+    def __init__(self):
+        self.shared = 0  # calls served by another caller's computation
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, function):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = {"done": threading.Event()}
+            else:
+                self.shared += 1
+
+        if not leader:
+            call["done"].wait()
+            if "error" in call:
+                raise call["error"]
+            return call["result"]
+
+        try:
+            call["result"] = function()
+            return call["result"]
+        except Exception as e:
+            call["error"] = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call["done"].set()
+
+
+score_flight = SingleFlight()
+shared_scores = None  # shm_cache.SharedScoreCache shared by worker processes, set up by api.py
 
 
 def get_score(store, phone, email, birthday=None, gender=None, first_name=None, last_name=None):
+    """
+    Score of a user, read through the cache shared by worker processes (if set up) and the store cache. Concurrent
+    calls with the same cache key share one computation.
+    """
+    if store is None:
+        return _compute_score(phone, email, birthday, gender, first_name, last_name)
+
+    key = score_key(phone, email, birthday, gender, first_name, last_name)
+    if shared_scores is not None:
+        score = shared_scores.get(key)
+        if score is not None:
+            return score
+
+    def cached_score():
+        score = store.cache_get(key)
+        if score is None:
+            score = _compute_score(phone, email, birthday, gender, first_name, last_name)
+            store.cache_set(key, score, SCORE_TTL)
+        if shared_scores is not None:
+            shared_scores.put(key, score)
+        return score
+
+    return score_flight.do(key, cached_score)
+
+
+def _compute_score(phone, email, birthday=None, gender=None, first_name=None, last_name=None):
     score = 0
     if phone:
-        score += 1.5
+        score += PHONE_WEIGHT
     if email:
-        score += 1.5
+        score += EMAIL_WEIGHT
     if birthday and gender:
-        score += 1.5
+        score += BIRTHDAY_GENDER_WEIGHT
     if first_name and last_name:
-        score += 0.5
+        score += NAME_WEIGHT
     return score
 
 
+def score_key(phone, email=None, birthday=None, gender=None, first_name=None, last_name=None) -> str:
+    """
+    Cache key of a score: a digest of every argument the score depends on.
+    """
+    if isinstance(birthday, (datetime.date, datetime.datetime)):
+        birthday = birthday.strftime("%Y%m%d")
+    elif birthday and birthday.count(".") == 2:
+        # DD.MM.YYYY as received in requests, day and month may have one digit
+        day, month, year = birthday.split(".")
+        birthday = year + month.zfill(2) + day.zfill(2)
+    key_parts = [first_name or "", last_name or "", str(phone or ""), birthday or "", email or "",
+                 "" if gender is None else str(gender)]
+    # parts are separated, so that e.g. first name "ab" and first name "a" with last name "b" get different keys
+    return "uid:" + hashlib.md5("\x1f".join(key_parts).encode(encoding='utf-8')).hexdigest()
+
+
+def _load_numpy():
+    global np
+    if np is NotImplemented:
+        try:
+            import numpy
+        except ImportError:
+            numpy = None
+        np = numpy
+    return np
+
+
+def _present(column):
+    # same truthiness as in get_score, computed for the whole column at once
+    values = np.asarray(column)
+    if values.dtype.kind in "biuf":
+        return values != 0
+    if values.dtype.kind in "US":
+        return values != values.dtype.type()
+    return np.frompyfunc(bool, 1, 1)(values).astype(bool)
+
+
+def get_score_bulk(store, phone, email, birthday, gender, first_name, last_name, chunk_size: int = 1000):
+    """
+    Score many users at once. Every argument is a column of equal length: a list, a NumPy array or an arrow-like
+    array convertible with numpy.asarray; missing values are None or empty.
+
+    With a store, scores are read through the cache shared by worker processes (if set up) and then the store cache
+    with one cache_get_many call per `chunk_size` keys; computed ones are written back with one cache_set_many call per
+    chunk. Returns a float NumPy array, or a list of floats when NumPy is not installed.
+    """
+    if _load_numpy() is not None:
+        scores = (
+            PHONE_WEIGHT * _present(phone)
+            + EMAIL_WEIGHT * _present(email)
+            + BIRTHDAY_GENDER_WEIGHT * (_present(birthday) & _present(gender))
+            + NAME_WEIGHT * (_present(first_name) & _present(last_name))
+        )
+    else:
+        scores = [
+            float(get_score(None, *row))
+            for row in zip(phone, email, birthday, gender, first_name, last_name)
+        ]
+
+    if store is None:
+        return scores
+
+    keys = [score_key(*row) for row in zip(phone, email, birthday, gender, first_name, last_name)]
+    if shared_scores is not None:
+        shared = [shared_scores.get(key) for key in keys]
+    else:
+        shared = [None] * len(keys)
+    uncached = []
+    for index, value in enumerate(shared):
+        if value is None:
+            uncached.append(index)
+        else:
+            scores[index] = value
+    for start in range(0, len(uncached), chunk_size):
+        chunk = uncached[start:start + chunk_size]
+        missing = {}
+        for index, value in zip(chunk, store.cache_get_many([keys[index] for index in chunk])):
+            if value is None:
+                value = missing[keys[index]] = float(scores[index])
+            scores[index] = value
+            if shared_scores is not None:
+                shared_scores.put(keys[index], value)
+        if missing:
+            store.cache_set_many(missing, SCORE_TTL)
+    return scores
+
+
+def encode_interests(value) -> int:
+    """
+    Catalog bitset of interests stored as a list of names or ids (or already as a bitset); unknown ones are skipped.
+    """
+    if isinstance(value, int):
+        return value & _ALL_INTERESTS
+    mask = 0
+    for interest in value or ():
+        interest_id = INTEREST_IDS.get(interest, interest)
+        if isinstance(interest_id, int) and 0 <= interest_id < len(INTERESTS):
+            mask |= 1 << interest_id
+    return mask
+
+
+def decode_interests(mask: int) -> list[str]:
+    return list(_DECODED_INTERESTS[mask])
+
+
+class InterestsCache:
+    """
+    Process-local read-through cache of client interests as catalog bitsets.
+
+    Args:
+        size: int, maximum number of cached clients, least recently used ones are evicted
+        ttl: float, time in seconds an entry is served before it is read from the store again
+    """
+
+    def __init__(self, size: int = INTERESTS_CACHE_SIZE, ttl: float = INTERESTS_CACHE_TTL):
+        self.size = size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, cid) -> int | None:
+        with self._lock:
+            entry = self._entries.get(cid)
+            if entry is None or entry[1] < time.monotonic():
+                self.misses += 1
+                return None
+            self._entries.move_to_end(cid)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, cid, mask: int, ttl: float | None = None):
+        with self._lock:
+            self._entries[cid] = (mask, time.monotonic() + (self.ttl if ttl is None else ttl))
+            self._entries.move_to_end(cid)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def snapshot(self) -> list[tuple]:
+        """
+        Entries that have not expired as (cid, mask, seconds left) tuples, least recently used first.
+        """
+        now = time.monotonic()
+        with self._lock:
+            return [(cid, mask, expires_at - now) for cid, (mask, expires_at) in self._entries.items()
+                    if expires_at > now]
+
+    def load(self, entries) -> int:
+        """
+        Put entries of a snapshot taken by another process. Returns number of entries.
+        """
+        count = 0
+        for cid, mask, ttl in entries:
+            self.put(cid, mask, ttl)
+            count += 1
+        return count
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+
+interests_cache = InterestsCache()
+
+
+def get_interests_many(store, cids) -> dict:
+    result = {}
+    missing = []
+    for cid in cids:
+        mask = interests_cache.get(cid)
+        if mask is None:
+            missing.append(cid)
+        else:
+            result[cid] = decode_interests(mask)
+
+    if missing:
+        values = store.get_many([f"i:{cid}" for cid in missing])
+        for cid, value in zip(missing, values):
+            mask = encode_interests(value)
+            interests_cache.put(cid, mask)
+            result[cid] = decode_interests(mask)
+    return result
+
+
 def get_interests(store, cid):
-    interests = ["cars", "pets", "travel", "hi-tech", "sport", "music", "books", "tv", "cinema", "geek", "otus"]
-    return random.sample(interests, 2)
+    return get_interests_many(store, [cid])[cid]
+
+
+def warm_interests_cache(store, cids, chunk_size: int = 1000) -> int:
+    """
+    Preload interests of the given clients into the process-local cache with bulk reads. Returns number of clients.
+    """
+    cids = list(cids)
+    for start in range(0, len(cids), chunk_size):
+        chunk = cids[start:start + chunk_size]
+        for cid, value in zip(chunk, store.get_many([f"i:{cid}" for cid in chunk])):
+            interests_cache.put(cid, encode_interests(value))
+    return len(cids)
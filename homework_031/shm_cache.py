@@ -0,0 +1,105 @@
+import hashlib
+import multiprocessing
+import struct
+import time
+from multiprocessing import shared_memory
+
+SHARED_CACHE_SLOTS = 1 << 20  # entries of the table, 32 MiB of shared memory
+SHARED_CACHE_TTL = 60  # seconds
+PROBES = 8  # slots looked at for a key, starting at its hash
+READ_RETRIES = 4  # attempts to read an entry that is being written before it is treated as a miss
+
+# seq, padding, key hash, value, expires_at; seq is odd while the entry is being written
+ENTRY = struct.Struct("<IIQdd")
+SEQ = struct.Struct("<I")
+EMPTY = 0
+
+
+class SharedScoreCache:
+    """
+    Fixed-size open-addressing hash table of float values with TTL in a shared memory segment, shared by worker
+    processes forked after it is created.
+
+    Readers take no lock: every entry carries a sequence number that a writer makes odd before changing the entry
+    and even after it, so a reader retries or misses an entry it has seen half-written. Writers are serialized by
+    a process-shared lock. Keys are stored as 64-bit hashes, a full table evicts the entry that expires first.
+
+    Args:
+        slots: int, number of entries (default: SHARED_CACHE_SLOTS)
+        ttl: float, time in seconds an entry is served (default: SHARED_CACHE_TTL)
+        name: str, name of an existing segment to attach to instead of creating one (default: None)
+        lock: multiprocessing.Lock, lock shared with other writers of an attached segment (default: a new lock)
+    """
+
+    def __init__(self, slots: int = SHARED_CACHE_SLOTS, ttl: float = SHARED_CACHE_TTL,
+                 name: str | None = None, lock=None):
+        self.slots = slots
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        if name is None:
+            self._memory = shared_memory.SharedMemory(create=True, size=slots * ENTRY.size)
+            self._memory.buf[:slots * ENTRY.size] = bytes(slots * ENTRY.size)
+        else:
+            self._memory = shared_memory.SharedMemory(name=name)
+        self._buffer = self._memory.buf
+        self._lock = lock or multiprocessing.Lock()
+
+    @property
+    def name(self) -> str:
+        return self._memory.name
+
+    @staticmethod
+    def _hash(key: str) -> int:
+        return int.from_bytes(hashlib.blake2b(key.encode('utf-8'), digest_size=8).digest(), 'little') or 1
+
+    def _read(self, offset: int):
+        for _ in range(READ_RETRIES):
+            seq, _, key_hash, value, expires_at = ENTRY.unpack_from(self._buffer, offset)
+            if not seq & 1 and SEQ.unpack_from(self._buffer, offset)[0] == seq:
+                return key_hash, value, expires_at
+        return None
+
+    def get(self, key: str) -> float | None:
+        key_hash = self._hash(key)
+        now = time.time()
+        for probe in range(PROBES):
+            entry = self._read((key_hash + probe) % self.slots * ENTRY.size)
+            if entry is None:
+                continue
+            if entry[0] == EMPTY:
+                break
+            if entry[0] == key_hash and entry[2] > now:
+                self.hits += 1
+                return entry[1]
+        self.misses += 1
+        return None
+
+    def put(self, key: str, value: float):
+        key_hash = self._hash(key)
+        now = time.time()
+        with self._lock:
+            victim, victim_expires_at = None, float("inf")
+            for probe in range(PROBES):
+                offset = (key_hash + probe) % self.slots * ENTRY.size
+                seq, _, entry_hash, _, expires_at = ENTRY.unpack_from(self._buffer, offset)
+                if entry_hash in (key_hash, EMPTY) or expires_at <= now:
+                    victim = offset
+                    break
+                if expires_at < victim_expires_at:
+                    victim, victim_expires_at = offset, expires_at
+
+            writing = (SEQ.unpack_from(self._buffer, victim)[0] + 1) & 0xFFFFFFFF
+            SEQ.pack_into(self._buffer, victim, writing)
+            ENTRY.pack_into(self._buffer, victim, writing, 0, key_hash, value, now + self.ttl)
+            SEQ.pack_into(self._buffer, victim, (writing + 1) & 0xFFFFFFFF)
+
+    def close(self):
+        self._buffer = None
+        self._memory.close()
+
+    def unlink(self):
+        """
+        Free the segment; called once by the process that created it, after the workers have exited.
+        """
+        self._memory.unlink()
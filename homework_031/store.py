@@ -0,0 +1,581 @@
+import bisect
+import hashlib
+import json
+import logging
+import threading
+import time
+from typing import TYPE_CHECKING, Optional
+
+if TYPE_CHECKING:
+    import redis
+
+
+logger = logging.getLogger('store')
+
+CACHE_SOCKET_TIMEOUT = 0.2  # time in seconds a cache operation waits for Redis before it counts as a miss
+DEADLINE_SOCKET_TIMEOUTS = (0.05, 0.1, 0.25, 0.5, 1., 2.)  # socket timeouts of clients for deadline-bound calls
+
+
+class StoreError(Exception):
+    pass
+
+
+class StoreUnavailable(StoreError):
+    pass
+
+
+class StoreTimeout(StoreError):
+    pass
+
+
+class Deadline:
+    """
+    Time budget of a single API request for store operations.
+
+    Args:
+        budget: float, time in seconds the request may spend waiting on the store
+    """
+
+    expires_at: float
+    store_wait: float  # total time in seconds spent in store calls made under this deadline
+
+    def __init__(self, budget: float):
+        self.expires_at = time.monotonic() + budget
+        self.store_wait = 0.
+
+    def remaining(self) -> float:
+        return max(0., self.expires_at - time.monotonic())
+
+    @property
+    def expired(self) -> bool:
+        return time.monotonic() >= self.expires_at
+
+
+class CircuitBreaker:
+    """
+    Fails fast while the store is down.
+
+    The breaker opens after `failure_threshold` consecutive failures and rejects all calls for `reset_timeout`
+    seconds. Then it lets a single probe call through (half-open state): success closes the breaker, failure opens
+    it for another `reset_timeout` seconds.
+
+    Args:
+        failure_threshold: int, consecutive failures that open the breaker (default: 5)
+        reset_timeout: float, time in seconds before a probe call is allowed (default: 5 seconds)
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half-open"
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 5.):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+
+        self.state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+                self.state = self.HALF_OPEN
+            if self.state == self.HALF_OPEN and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self._failures = 0
+            self._probe_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self.state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    logger.warning("Store circuit breaker opened after %d failure(s)", self._failures)
+                self.state = self.OPEN
+                self._opened_at = time.monotonic()
+                self._probe_in_flight = False
+
+
+def _redis():
+    """
+    redis-py, imported with the first Store: it takes longer to import than the rest of the API, and command-line uses
+    of api.py never connect to Redis.
+    """
+    import redis.backoff
+    return redis
+
+
+class Store:
+    """
+    Client for Redis server.
+
+    Args:
+        host: str, host at which Redis server is running (default: localhost)
+        port: int, port at which Redis server is running (default: 6379)
+        timeout: float, time in seconds to wait on heavy operations (default: 3 seconds)
+        retries: int, times to retry heavy operations (default: 10 times)
+        breaker: CircuitBreaker, shared by all operations (default: CircuitBreaker with default settings)
+    """
+
+    host: str
+    port: int
+    timeout: float
+    retries: int
+    breaker: CircuitBreaker
+    stats: dict  # counters of store calls: calls, failures, rejected, timeouts, wait_seconds
+
+    _connection_cache: Optional['redis.Redis'] = None  # client for lightweight cache operations; does not wait or retry
+    _connection_heavy: Optional['redis.Redis'] = None  # client for heavyweight storage operations; waits and retries
+    _connections_bounded: dict  # clients by socket timeout for calls that must fit in the rest of a request deadline
+
+    def __init__(self, host: str = 'localhost', port: int = 6379,
+                 timeout: float = 3., retries: int = 10, breaker: Optional[CircuitBreaker] = None):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.retries = retries
+        self.breaker = breaker or CircuitBreaker()
+        self.stats = {"calls": 0, "failures": 0, "rejected": 0, "timeouts": 0, "wait_seconds": 0.}
+
+        self._redis = _redis()
+        self._backoff = self._redis.backoff.ExponentialBackoff(self.timeout, 0.1)
+        self._stats_lock = threading.Lock()
+        self._connection_cache = None
+        self._connection_heavy = None
+        self._connections_bounded = {}
+        self._connect_timeout = None
+
+    def connect(self, timeout: float = 10.):
+        """
+        Establish connection to Redis server at host:port specified at constructor.
+
+        Args:
+            timeout: float, time in seconds to wait until connection is established (default: 10 seconds)
+        """
+        self._connect_timeout = timeout / 2
+        self._connection_cache = self._redis.Redis(self.host, self.port, decode_responses=True,
+                                                   socket_connect_timeout=timeout / 2,
+                                                   socket_timeout=min(self.timeout, CACHE_SOCKET_TIMEOUT))
+        # retries are done by the store itself, so that they respect request deadlines and the circuit breaker
+        self._connection_heavy = self._redis.Redis(self.host, self.port, decode_responses=True,
+                                                   socket_connect_timeout=timeout / 2,
+                                                   socket_timeout=self.timeout)
+        logger.info("Connected to Redis server at %s:%d", self.host, self.port)
+
+    def disconnect(self):
+        """
+        Disconnect from Redis server.
+        """
+        self._connection_cache.close()
+        self._connection_heavy.close()
+        for connection in self._connections_bounded.values():
+            connection.close()
+        self._connection_cache, self._connection_heavy = None, None
+        self._connections_bounded = {}
+        logger.info("Disconnected from Redis server at %s:%d", self.host, self.port)
+
+    def session(self, deadline: Deadline) -> 'StoreSession':
+        """
+        Bind store operations of a single request to its deadline.
+        """
+        return StoreSession(self, deadline)
+
+    def _count(self, name: str, value=1):
+        with self._stats_lock:
+            self.stats[name] += value
+
+    def _bounded(self, connection: 'redis.Redis', deadline: Optional[Deadline]) -> 'redis.Redis':
+        """
+        Client to make a call on that does not wait on a socket longer than the rest of the deadline: the client itself
+        if its socket timeout fits, otherwise a client with the longest of DEADLINE_SOCKET_TIMEOUTS that fits.
+        """
+        if deadline is None or isinstance(connection, self._redis.client.Pipeline):
+            # a pipeline is bounded by the client it is made from
+            return connection
+        remaining = deadline.remaining()
+        if (connection.connection_pool.connection_kwargs.get("socket_timeout") or float("inf")) <= remaining:
+            return connection
+        timeout = max([timeout for timeout in DEADLINE_SOCKET_TIMEOUTS if timeout <= remaining],
+                      default=DEADLINE_SOCKET_TIMEOUTS[0])
+        bounded = self._connections_bounded.get(timeout)
+        if bounded is None:
+            # a client that loses the race is dropped before it opens any connection
+            bounded = self._connections_bounded.setdefault(timeout, self._redis.Redis(
+                self.host, self.port, decode_responses=True,
+                socket_connect_timeout=min(timeout, self._connect_timeout), socket_timeout=timeout,
+            ))
+        return bounded
+
+    def _call(self, connection: 'redis.Redis', command: str, *args, retries: int = 0,
+              deadline: Optional[Deadline] = None, **kwargs):
+        if deadline is not None and deadline.expired:
+            self._count("timeouts")
+            raise StoreTimeout(f"Request deadline exceeded before calling Redis at {self.host}:{self.port}")
+        if not self.breaker.allow():
+            self._count("rejected")
+            raise StoreUnavailable(f"Redis at {self.host}:{self.port} is unavailable, circuit breaker is open")
+
+        started = time.monotonic()
+        self._count("calls")
+        try:
+            for attempt in range(retries + 1):
+                try:
+                    result = getattr(self._bounded(connection, deadline), command)(*args, **kwargs)
+                except self._redis.RedisError as e:
+                    self._count("failures")
+                    self.breaker.record_failure()
+                    if attempt == retries or not self.breaker.allow():
+                        raise StoreError(
+                            f"An error occurred while trying to {command} from Redis at {self.host}:{self.port}"
+                        ) from e
+                    pause = self._backoff.compute(attempt)
+                    if deadline is not None and deadline.remaining() <= pause:
+                        self._count("timeouts")
+                        raise StoreTimeout(
+                            f"Request deadline exceeded while waiting for Redis at {self.host}:{self.port}"
+                        ) from e
+                    time.sleep(pause)
+                else:
+                    self.breaker.record_success()
+                    return result
+        finally:
+            waited = time.monotonic() - started
+            self._count("wait_seconds", waited)
+            if deadline is not None:
+                deadline.store_wait += waited
+
+    def cache_get(self, key: str, deadline: Optional[Deadline] = None):
+        """
+        Read value from Redis server by key and decode it as JSON string. If server is unavailable, returns None.
+
+        Args:
+            key: str, key for resource
+            deadline: Deadline, time budget of the calling request (default: no deadline)
+
+        Returns:
+            None if server unavailable or no value is stored for key, decoded value otherwise
+        """
+        try:
+            value = self._call(self._connection_cache, 'get', key, deadline=deadline)
+        except StoreUnavailable:
+            value = None
+        except StoreError as e:
+            logger.warning("Failed to read 1 key from Redis cache at %s:%d: %s", self.host, self.port,
+                           type(e).__name__)
+            value = None
+
+        if value is not None:
+            return json.loads(value)
+        else:
+            return None
+
+    def cache_set(self, key, value, ttl, deadline: Optional[Deadline] = None):
+        """
+        Write JSON-encoded value to server by key with TTL. If server is unavailable, does nothing.
+
+        Args:
+            key: str, key for resource
+            value: value to store
+            ttl: time-to-live in seconds
+            deadline: Deadline, time budget of the calling request (default: no deadline)
+
+        Returns:
+            None
+        """
+        try:
+            self._call(self._connection_cache, 'set', key, json.dumps(value), ex=ttl, deadline=deadline)
+        except StoreUnavailable:
+            pass
+        except StoreError as e:
+            logger.warning("Failed to write 1 key to Redis cache at %s:%d: %s", self.host, self.port,
+                           type(e).__name__)
+
+    def cache_get_many(self, keys: list, deadline: Optional[Deadline] = None) -> list:
+        """
+        Read many values from Redis cache with a single MGET. If server is unavailable, returns Nones.
+
+        Args:
+            keys: list of str, keys for resources
+            deadline: Deadline, time budget of the calling request (default: no deadline)
+
+        Returns:
+            list of decoded values in order of keys, None for keys without a value
+        """
+        if not keys:
+            return []
+        try:
+            values = self._call(self._connection_cache, 'mget', keys, deadline=deadline)
+        except StoreUnavailable:
+            values = [None] * len(keys)
+        except StoreError as e:
+            logger.warning("Failed to read %d key(s) from Redis cache at %s:%d: %s", len(keys), self.host, self.port,
+                           type(e).__name__)
+            values = [None] * len(keys)
+
+        return [json.loads(value) if value is not None else None for value in values]
+
+    def cache_set_many(self, mapping: dict, ttl, deadline: Optional[Deadline] = None):
+        """
+        Write many JSON-encoded values to Redis cache with TTL in a single pipeline. If server is unavailable,
+        does nothing.
+
+        Args:
+            mapping: dict, values by keys
+            ttl: time-to-live in seconds
+            deadline: Deadline, time budget of the calling request (default: no deadline)
+        """
+        if not mapping:
+            return
+        pipeline = self._bounded(self._connection_cache, deadline).pipeline(transaction=False)
+        for key, value in mapping.items():
+            pipeline.set(key, json.dumps(value), ex=ttl)
+        try:
+            self._call(pipeline, 'execute', deadline=deadline)
+        except StoreUnavailable:
+            pass
+        except StoreError as e:
+            logger.warning("Failed to write %d key(s) to Redis cache at %s:%d: %s", len(mapping), self.host,
+                           self.port, type(e).__name__)
+
+    def get(self, key, deadline: Optional[Deadline] = None):
+        """
+        Read value from Redis server by key and decode it as JSON string. If server is unavailable, raises an exception.
+        Failed reads are retried with exponential backoff until retries, the deadline or the circuit breaker run out.
+
+        Args:
+            key: str, key for resource
+            deadline: Deadline, time budget of the calling request (default: no deadline)
+
+        Raises:
+            StoreError if server is unavailable, StoreTimeout if the deadline is exceeded,
+            StoreUnavailable if the circuit breaker is open
+
+        Returns:
+            None if no value is stored for key, decoded value otherwise
+        """
+        value = self._call(self._connection_heavy, 'get', key, retries=self.retries, deadline=deadline)
+        if value is not None:
+            return json.loads(value)
+        else:
+            return None
+
+    def get_many(self, keys: list, deadline: Optional[Deadline] = None) -> list:
+        """
+        Read many values from Redis persistent storage with a single MGET, retried as `get`.
+
+        Args:
+            keys: list of str, keys for resources
+            deadline: Deadline, time budget of the calling request (default: no deadline)
+
+        Raises:
+            StoreError if server is unavailable, StoreTimeout if the deadline is exceeded,
+            StoreUnavailable if the circuit breaker is open
+
+        Returns:
+            list of decoded values in order of keys, None for keys without a value
+        """
+        if not keys:
+            return []
+        values = self._call(self._connection_heavy, 'mget', keys, retries=self.retries, deadline=deadline)
+        return [json.loads(value) if value is not None else None for value in values]
+
+    def scan(self, pattern: str, limit: int) -> list[str]:
+        """
+        Keys of Redis persistent storage matching the pattern, at most `limit` of them.
+
+        Raises:
+            StoreError if server is unavailable
+        """
+        keys = []
+        cursor = 0
+        while len(keys) < limit:
+            cursor, batch = self._call(self._connection_heavy, 'scan', cursor, match=pattern, count=1000,
+                                       retries=self.retries)
+            keys.extend(batch)
+            if cursor == 0:
+                break
+        return keys[:limit]
+
+
+class HashRing:
+    """
+    Consistent hash ring: every node owns `vnodes` points on the ring and a key belongs to the node owning the first
+    point after the hash of the key. Adding or removing a node only remaps the keys between its points.
+
+    Args:
+        nodes: iterable of str, names of nodes
+        vnodes: int, points on the ring per node (default: 256)
+    """
+
+    def __init__(self, nodes=(), vnodes: int = 256):
+        self.vnodes = vnodes
+        self._points = []
+        self._owners = []
+        for node in nodes:
+            self.add(node)
+
+    @staticmethod
+    def _hash(value: str) -> int:
+        return int.from_bytes(hashlib.md5(value.encode('utf-8')).digest()[:8], 'big')
+
+    def add(self, node: str):
+        for replica in range(self.vnodes):
+            point = self._hash(f"{node}#{replica}")
+            index = bisect.bisect(self._points, point)
+            self._points.insert(index, point)
+            self._owners.insert(index, node)
+
+    def remove(self, node: str):
+        kept = [(point, owner) for point, owner in zip(self._points, self._owners) if owner != node]
+        self._points = [point for point, _ in kept]
+        self._owners = [owner for _, owner in kept]
+
+    def get(self, key: str) -> str:
+        index = bisect.bisect(self._points, self._hash(key))
+        return self._owners[index % len(self._owners)]
+
+
+class ShardedStore:
+    """
+    Store spread over several Redis-compatible nodes with a consistent hash ring. Multi-key operations are grouped
+    by node, so every node gets one MGET or pipeline per call.
+
+    Args:
+        nodes: dict, stores by node names, e.g. {"10.0.0.1:6379": Store("10.0.0.1", 6379)}
+        vnodes: int, points on the ring per node (default: 256)
+    """
+
+    def __init__(self, nodes: dict, vnodes: int = 256):
+        self.nodes = dict(nodes)
+        self.ring = HashRing(self.nodes, vnodes)
+
+    @classmethod
+    def from_addresses(cls, addresses: list[str], make_breaker=None, **store_kwargs) -> 'ShardedStore':
+        """
+        Sharded store of Store nodes named by their "host:port" addresses.
+
+        Args:
+            addresses: list of str, "host:port" of every node
+            make_breaker: callable, returns a CircuitBreaker for a node, so that one failing node does not
+                          reject calls to the others (default: None, no breakers)
+            store_kwargs: passed to every Store
+        """
+        nodes = {}
+        for address in addresses:
+            host, _, port = address.rpartition(":")
+            breaker = make_breaker() if make_breaker else None
+            nodes[address] = Store(host, int(port), breaker=breaker, **store_kwargs)
+        return cls(nodes)
+
+    @property
+    def stats(self) -> dict:
+        stats = {}
+        for node in self.nodes.values():
+            for name, value in node.stats.items():
+                stats[name] = stats.get(name, 0) + value
+        return stats
+
+    def add_node(self, name: str, store):
+        self.nodes[name] = store
+        self.ring.add(name)
+
+    def remove_node(self, name: str):
+        self.ring.remove(name)
+        return self.nodes.pop(name)
+
+    def connect(self, timeout: float = 10.):
+        for node in self.nodes.values():
+            node.connect(timeout)
+
+    def disconnect(self):
+        for node in self.nodes.values():
+            node.disconnect()
+
+    def session(self, deadline: Deadline) -> 'StoreSession':
+        return StoreSession(self, deadline)
+
+    def node(self, key: str):
+        return self.nodes[self.ring.get(key)]
+
+    def _group(self, keys) -> dict:
+        groups = {}
+        for index, key in enumerate(keys):
+            groups.setdefault(self.ring.get(key), []).append(index)
+        return groups
+
+    def _get_many(self, method: str, keys: list, deadline: Optional[Deadline]) -> list:
+        values = [None] * len(keys)
+        for name, indexes in self._group(keys).items():
+            node_values = getattr(self.nodes[name], method)([keys[index] for index in indexes], deadline=deadline)
+            for index, value in zip(indexes, node_values):
+                values[index] = value
+        return values
+
+    def cache_get(self, key: str, deadline: Optional[Deadline] = None):
+        return self.node(key).cache_get(key, deadline=deadline)
+
+    def cache_set(self, key, value, ttl, deadline: Optional[Deadline] = None):
+        return self.node(key).cache_set(key, value, ttl, deadline=deadline)
+
+    def get(self, key, deadline: Optional[Deadline] = None):
+        return self.node(key).get(key, deadline=deadline)
+
+    def cache_get_many(self, keys: list, deadline: Optional[Deadline] = None) -> list:
+        return self._get_many('cache_get_many', keys, deadline)
+
+    def get_many(self, keys: list, deadline: Optional[Deadline] = None) -> list:
+        return self._get_many('get_many', keys, deadline)
+
+    def cache_set_many(self, mapping: dict, ttl, deadline: Optional[Deadline] = None):
+        groups = {}
+        for key, value in mapping.items():
+            groups.setdefault(self.ring.get(key), {})[key] = value
+        for name, node_mapping in groups.items():
+            self.nodes[name].cache_set_many(node_mapping, ttl, deadline=deadline)
+
+    def scan(self, pattern: str, limit: int) -> list[str]:
+        keys = []
+        for node in self.nodes.values():
+            keys.extend(node.scan(pattern, limit - len(keys)))
+            if len(keys) >= limit:
+                break
+        return keys
+
+
+class StoreSession:
+    """
+    Store operations of a single request: every call is bounded by the request deadline and its time is accounted
+    in `deadline.store_wait`.
+    """
+
+    def __init__(self, store, deadline: Deadline):
+        self.store = store
+        self.deadline = deadline
+
+    def cache_get(self, key):
+        return self.store.cache_get(key, deadline=self.deadline)
+
+    def cache_set(self, key, value, ttl):
+        return self.store.cache_set(key, value, ttl, deadline=self.deadline)
+
+    def get(self, key):
+        return self.store.get(key, deadline=self.deadline)
+
+    def get_many(self, keys):
+        return self.store.get_many(keys, deadline=self.deadline)
+
+    def cache_get_many(self, keys):
+        return self.store.cache_get_many(keys, deadline=self.deadline)
+
+    def cache_set_many(self, mapping, ttl):
+        return self.store.cache_set_many(mapping, ttl, deadline=self.deadline)
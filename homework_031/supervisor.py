@@ -0,0 +1,130 @@
+import logging
+import os
+import signal
+import threading
+
+
+class Supervisor:
+    """
+    Pre-forked worker processes accepting connections on the listening socket of `server`.
+
+    SIGHUP reloads the workers without closing the socket: the old workers stop accepting connections and hand
+    over their state, new workers are forked, and the old ones exit once their in-flight requests are done.
+    Connections arriving in between wait in the listen backlog. SIGTERM and SIGINT stop the workers the same way.
+    A worker that exits on its own is replaced.
+
+    Args:
+        server: socketserver.BaseServer, bound and listening before the workers are forked
+        workers: int, number of worker processes
+        worker: object with `start`, `handover` and `stop` methods called in every worker process: before it serves,
+                after it stopped accepting connections and before its successors are forked, and before it exits
+    """
+
+    SIGNALS = {signal.SIGHUP, signal.SIGTERM, signal.SIGINT}
+
+    def __init__(self, server, workers: int, worker):
+        self.server = server
+        self.workers = workers
+        self.worker = worker
+        # pid of every worker of the current generation -> read end of a pipe the worker closes
+        # when it stops accepting connections
+        self.generation = {}
+        self._pids = set()
+        self._stopping = False
+        self._reloading = False
+
+    def run(self):
+        """
+        Fork the workers and supervise them until they are stopped.
+        """
+        signal.signal(signal.SIGHUP, self.reload)
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        # every worker waits for the socket to become readable and then accepts; a worker that lost the race for
+        # a connection must not block in accept, where it would never see the shutdown request
+        self.server.socket.setblocking(False)
+        for _ in range(self.workers):
+            self._fork()
+
+        while self._pids:
+            # interrupted by signals, os.wait is retried after their handlers have run
+            pid, _ = os.wait()
+            self._pids.discard(pid)
+            stopped = self.generation.pop(pid, None)
+            if stopped is not None:
+                os.close(stopped)
+                if not self._stopping:
+                    logging.error("Worker %d exited unexpectedly, starting a new one", pid)
+                    self._fork()
+
+    def reload(self, *_):
+        if self._reloading or self._stopping:
+            return
+        self._reloading = True
+        try:
+            previous, self.generation = self.generation, {}
+            self._terminate(previous)
+            for stopped in previous.values():
+                # EOF once the worker has stopped accepting and handed over its state, or has died
+                os.read(stopped, 1)
+                os.close(stopped)
+            for _ in range(self.workers):
+                if self._stopping:
+                    # stopped while the old workers were draining, so there is nothing to replace them with
+                    logging.info("Workers stopped during reload: %s", sorted(previous))
+                    return
+                self._fork()
+            logging.info("Workers reloaded: %s -> %s", sorted(previous), sorted(self.generation))
+        finally:
+            self._reloading = False
+
+    def stop(self, *_):
+        self._stopping = True
+        self._terminate(self.generation)
+
+    @staticmethod
+    def _terminate(generation: dict):
+        for pid in generation:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def _fork(self):
+        stopped, stopping = os.pipe()
+        # the child inherits the handlers of the supervisor, so signals wait until it has installed its own
+        signal.pthread_sigmask(signal.SIG_BLOCK, self.SIGNALS)
+        try:
+            pid = os.fork()
+            if pid == 0:
+                self._install_worker_handlers()
+        finally:
+            signal.pthread_sigmask(signal.SIG_UNBLOCK, self.SIGNALS)
+        if pid == 0:
+            os.close(stopped)
+            self._serve(stopping)
+        os.close(stopping)
+        self.generation[pid] = stopped
+        self._pids.add(pid)
+
+    def _install_worker_handlers(self):
+        signal.signal(signal.SIGHUP, signal.SIG_IGN)
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        # shutdown waits for serve_forever to return, so it can not be called from its own thread
+        signal.signal(signal.SIGTERM, lambda *_: threading.Thread(target=self.server.shutdown).start())
+
+    def _serve(self, stopping: int):
+        code = 0
+        try:
+            for stopped in self.generation.values():
+                os.close(stopped)
+            self.worker.start()
+            self.server.serve_forever()
+            self.worker.handover()
+            os.close(stopping)
+            self.worker.stop()
+        except Exception:
+            logging.exception("Worker %d failed", os.getpid())
+            code = 1
+        finally:
+            os._exit(code)
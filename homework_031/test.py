@@ -1,9 +1,43 @@
-import hashlib
+import collections
 import datetime
+import hashlib
 import functools
+import gzip
+import http.client
+import io
+import json
+import logging
+import multiprocessing
+import os
+import queue
+import signal
+import socket
+import socketserver
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
 import unittest
+from unittest import mock
 
+import access_log
+import admission
 import api
+import api_server
+import bulk_validate
+import capture
+import embedded_store
+import json_codec
+import loadtest
+import metrics
+import replay
+import scoring
+import shm_cache
+import store
+import supervisor
+import warmup
 
 
 def cases(cases):
@@ -23,10 +57,11 @@ class TestSuite(unittest.TestCase):
     def setUp(self):
         self.context = {}
         self.headers = {}
-        self.settings = {}
+        self.settings = loadtest.FakeStore(clients=10)
+        scoring.interests_cache.clear()
 
     def get_response(self, request):
-        return api.method_handler({"body": request, "headers": self.headers}, self.context, self.settings)
+        return api_server.method_handler({"body": request, "headers": self.headers}, self.context, self.settings)
 
     def set_valid_auth(self, request):
         if request.get("login") == api.ADMIN_LOGIN:
@@ -44,6 +79,9 @@ class TestSuite(unittest.TestCase):
         {"account": "horns&hoofs", "login": "h&f", "method": "online_score", "token": "", "arguments": {}},
         {"account": "horns&hoofs", "login": "h&f", "method": "online_score", "token": "sdd", "arguments": {}},
         {"account": "horns&hoofs", "login": "admin", "method": "online_score", "token": "", "arguments": {}},
+        {"account": "horns&hoofs", "login": "h&f", "method": "online_score", "token": [], "arguments": {}},
+        {"account": {}, "login": "h&f", "method": "online_score", "token": "sdd", "arguments": {}},
+        {"account": "horns&hoofs", "login": [], "method": "online_score", "token": "sdd", "arguments": {}},
     ])
     def test_bad_auth(self, request):
         _, code = self.get_response(request)
@@ -67,6 +105,7 @@ class TestSuite(unittest.TestCase):
         {"phone": "79175002040", "email": "stupnikovotus.ru"},
         {"phone": "79175002040", "email": "stupnikov@otus.ru", "gender": -1},
         {"phone": "79175002040", "email": "stupnikov@otus.ru", "gender": "1"},
+        {"phone": "79175002040", "email": "stupnikov@otus.ru", "gender": [1]},
         {"phone": "79175002040", "email": "stupnikov@otus.ru", "gender": 1, "birthday": "01.01.1890"},
         {"phone": "79175002040", "email": "stupnikov@otus.ru", "gender": 1, "birthday": "XXX"},
         {"phone": "79175002040", "email": "stupnikov@otus.ru", "gender": 1, "birthday": "01.01.2000", "first_name": 1},
@@ -140,6 +179,1082 @@ class TestSuite(unittest.TestCase):
                             for v in response.values()))
         self.assertEqual(self.context.get("nclients"), len(arguments["client_ids"]))
 
+    @cases([
+        (api.MethodRequest, {"login": "h&f", "token": "", "arguments": {}, "method": "online_score"}),
+        (api.OnlineScoreRequest, {"phone": "79175002040", "email": "stupnikov@otus.ru"}),
+        (api.ClientsInterestsRequest, {"client_ids": [1, 2]}),
+    ])
+    def test_request_slots(self, request_class, arguments):
+        request = request_class(arguments)
+        self.assertFalse(hasattr(request, "__dict__"))
+        self.assertEqual(tuple(name for name, _ in request_class._fields), request_class._field_names)
+        with self.assertRaises(AttributeError):
+            request.unknown_field = 1
+
+    @cases([
+        (api.CharField(), ["a", "", 1, [], {}]),
+        (api.ArgumentsField(), [{"a": 1}, {}, {1: 2}, [], "", "a"]),
+        (api.EmailField(), ["a@b", "ab", "", 1]),
+        (api.PhoneField(), ["79175002040", 79175002040, "89175002040", "7917500204", "", 1.5, []]),
+        (api.DateField(), ["01.01.2000", "1.1.2000", "", 20000101, "XXX"]),
+        (api.BirthDayField(), ["01.01.2000", "01.01.1890", "01.01.2990", "", "XXX"]),
+        (api.GenderField(), [0, 1, 2, 3, True, "1", "", [1], 1.0]),
+        (api.ClientIDsField(required=True), [[1, 2], [], [1, "2"], "1", {}]),
+        (api.MethodRequestsField(required=True), [[{}], [], [1], {}]),
+    ])
+    def test_compiled_field_check(self, field, values):
+        field.__set_name__(None, "field")
+        check = field.compile()
+        for value in values:
+            try:
+                expected = field.valid_value(value)
+            except api.ValidationError:
+                with self.assertRaises(api.ValidationError):
+                    check(value)
+            else:
+                self.assertEqual(expected, check(value))
+
+    def test_json_schema(self):
+        schema = api.OnlineScoreRequest.json_schema()
+        self.assertEqual("object", schema["type"])
+        self.assertEqual(list(api.OnlineScoreRequest._field_names), list(schema["properties"]))
+        self.assertEqual([], schema["required"])
+        self.assertEqual(3, len(schema["anyOf"]))
+        schema = api.MethodRequest.json_schema()
+        self.assertEqual(["login", "token", "arguments", "method"], schema["required"])
+        self.assertEqual({"anyOf": [{"type": "string"}, {"type": "null"}]}, schema["properties"]["login"])
+        self.assertEqual({"type": "string"}, schema["properties"]["method"])
+        json.dumps(api.ClientsInterestsRequest.json_schema())
+
+    @cases(json_codec.available_codecs())
+    def test_json_codec(self, name):
+        codec = json_codec.get_codec(name)
+        self.assertEqual(codec.loads(b'{"login": "h&f", "arguments": {}}'), {"login": "h&f", "arguments": {}})
+        envelope = {"response": {1: ["cars", "pets"]}, "code": api.OK}
+        self.assertEqual(codec.loads(codec.dumps(envelope)), {"response": {"1": ["cars", "pets"]}, "code": api.OK})
+
+    def test_auth_cache(self):
+        request = {"account": "horns&hoofs", "login": "h&f", "method": "online_score",
+                   "arguments": {"phone": "79175002040", "email": "stupnikov@otus.ru"}}
+        self.set_valid_auth(request)
+        api.check_user_token.cache_clear()
+        self.get_response(request)
+        self.get_response(request)
+        self.assertEqual(api.check_user_token.cache_info().hits, 1)
+
+    def test_admin_token_cached_until_next_hour(self):
+        token = api.AdminToken()
+        digest = token.get()
+        self.assertIs(token.get(), digest)
+        token._expires_at = 0.
+        token.get()
+        self.assertGreater(token._expires_at, datetime.datetime.now().timestamp())
+
+    @cases([
+        ("01.01.2000", datetime.datetime(2000, 1, 1)),
+        ("29.02.2024", datetime.datetime(2024, 2, 29)),
+        ("31.12.1999", datetime.datetime(1999, 12, 31)),
+        ("1.1.2000", datetime.datetime(2000, 1, 1)),
+        ("9.11.2000", datetime.datetime(2000, 11, 9)),
+    ])
+    def test_parse_date(self, value, expected):
+        self.assertEqual(expected, api.parse_date(value))
+
+    @cases(["001.01.2000", "1..2000", "01.01.20", "1.1.2000.", "2000.01.01", "01-01-2000", "29.02.2023",
+            "32.01.2000", "01.1a.2000", "01.01.２０００", ""])
+    def test_parse_invalid_date(self, value):
+        with self.assertRaises(ValueError):
+            api.parse_date(value)
+
+    def test_today_cached_until_midnight(self):
+        today = api.Today()
+        self.assertEqual(datetime.date.today(), today.get())
+        expires_at = today._expires_at
+        today.get()
+        self.assertEqual(expires_at, today._expires_at)
+        tomorrow = datetime.date.today() + datetime.timedelta(days=1)
+        self.assertEqual(datetime.datetime.combine(tomorrow, datetime.time()).timestamp(), expires_at)
+
+    def test_batch_request(self):
+        items = [
+            {"account": "horns&hoofs", "login": "h&f", "method": "online_score",
+             "arguments": {"phone": "79175002040", "email": "stupnikov@otus.ru"}},
+            {"account": "horns&hoofs", "login": "h&f", "method": "online_score",
+             "arguments": {"phone": "79175002040", "email": "stupnikov@otus.ru"}},
+            {"account": "horns&hoofs", "login": "h&f", "method": "clients_interests",
+             "arguments": {"client_ids": [1, 2]}},
+            {"account": "horns&hoofs", "login": "admin", "method": "online_score",
+             "arguments": {"first_name": "a", "last_name": "b"}},
+            {"account": "horns&hoofs", "login": "h&f", "method": "online_score", "arguments": {}},
+            {"account": "horns&hoofs", "login": "h&f", "method": "batch", "arguments": {}},
+        ]
+        for item in items:
+            self.set_valid_auth(item)
+        items.append({"account": "horns&hoofs", "login": "h&f", "method": "online_score", "token": "sdd",
+                      "arguments": {"phone": "79175002040", "email": "stupnikov@otus.ru"}})
+        request = {"account": "horns&hoofs", "login": "h&f", "method": "batch", "arguments": {"requests": items}}
+        self.set_valid_auth(request)
+        response, code = self.get_response(request)
+        self.assertEqual(api.OK, code)
+        self.assertEqual([api.OK, api.OK, api.OK, api.OK, api.INVALID_REQUEST, api.NOT_FOUND, api.FORBIDDEN],
+                         [item["code"] for item in response])
+        self.assertEqual(response[0], response[1])
+        self.assertEqual(sorted(response[2]["response"]), [1, 2])
+        self.assertEqual(response[3]["response"], {"score": 42})
+        self.assertEqual(self.context["nrequests"], len(items))
+
+    def test_batch_null_values_of_other_types(self):
+        item = {"account": "horns&hoofs", "login": "h&f", "method": "online_score",
+                "arguments": {"phone": "79175002040", "email": "stupnikov@otus.ru"}}
+        self.set_valid_auth(item)
+        items = [
+            item,
+            {**item, "arguments": {**item["arguments"], "first_name": [], "last_name": {}}},
+            {**item, "token": []},
+            {**item, "arguments": {"email": "stupnikov@otus.ru", "birthday": "01.01.2000", "gender": 1}},
+        ]
+        request = {"account": "horns&hoofs", "login": "h&f", "method": "batch", "arguments": {"requests": items}}
+        self.set_valid_auth(request)
+        with mock.patch.object(self.settings, "cache_get_many", wraps=self.settings.cache_get_many) as cache_get_many:
+            response, code = self.get_response(request)
+        self.assertEqual(api.OK, code)
+        self.assertEqual([(api.OK, {"score": 3.}), (api.OK, {"score": 3.}), (api.FORBIDDEN, None),
+                          (api.OK, {"score": 3.})],
+                         [(item["code"], item.get("response")) for item in response])
+        cache_get_many.assert_called_once()
+
+    @cases([
+        {},
+        {"requests": []},
+        {"requests": [1, 2]},
+        {"requests": {"login": "h&f"}},
+    ])
+    def test_invalid_batch_request(self, arguments):
+        request = {"account": "horns&hoofs", "login": "h&f", "method": "batch", "arguments": arguments}
+        self.set_valid_auth(request)
+        response, code = self.get_response(request)
+        self.assertEqual(api.INVALID_REQUEST, code, arguments)
+        self.assertTrue(len(response))
+
+    def test_histogram_quantile(self):
+        histogram = metrics.Histogram()
+        for value in [0.001] * 99 + [1.]:
+            histogram.observe(value)
+        self.assertAlmostEqual(0.001, histogram.quantile(0.5), delta=0.001 / metrics.SUB_BUCKETS)
+        self.assertAlmostEqual(1., histogram.quantile(0.999), delta=1. / metrics.SUB_BUCKETS)
+        self.assertEqual(100, histogram.count)
+
+    def test_access_log_json_lines(self):
+        stream = io.StringIO()
+        handler = access_log.BatchStreamHandler(stream)
+        handler.setFormatter(access_log.JsonFormatter())
+        log_queue = queue.Queue()
+        logger = logging.getLogger("test_access_log")
+        logger.propagate = False
+        logger.addHandler(access_log.NonBlockingQueueHandler(log_queue))
+        listener = access_log.BatchQueueListener(log_queue, handler, batch_size=2)
+        listener.start()
+        logger.warning({"request_id": "42", "code": api.OK, "response": {1: ["cars"]}})
+        logger.warning("plain %s", "message")
+        logger.warning("third")
+        listener.stop()
+        lines = [json.loads(line) for line in stream.getvalue().splitlines()]
+        self.assertEqual(["42", None, None], [line.get("request_id") for line in lines])
+        self.assertEqual({"1": ["cars"]}, lines[0]["response"])
+        self.assertEqual("plain message", lines[1]["message"])
+
+    def test_score_bulk(self):
+        rows = [
+            ("79175002040", "stupnikov@otus.ru", None, None, None, None),
+            ("", "stupnikov@otus.ru", "01.01.2000", 1, "a", "b"),
+            (None, None, "01.01.2000", 0, "a", None),
+            ("79175002040", "", "", 2, "", "b"),
+        ]
+        columns = [list(column) for column in zip(*rows)]
+        expected = [scoring.get_score(None, *row) for row in rows]
+        self.assertEqual(expected, list(scoring.get_score_bulk(None, *columns)))
+        with mock.patch.object(scoring, "np", None):
+            self.assertEqual(expected, scoring.get_score_bulk(None, *columns))
+
+        cache = loadtest.FakeStore(clients=0)
+        cache.data[scoring.score_key(*rows[0])] = 100.
+        scores = scoring.get_score_bulk(cache, *columns)
+        self.assertEqual([100.] + expected[1:], list(scores))
+        self.assertEqual(expected[1], cache.data[scoring.score_key(*rows[1])])
+
+        cache = loadtest.FakeStore(clients=0)
+        with mock.patch.object(cache, "cache_get_many", wraps=cache.cache_get_many) as cache_get_many, \
+                mock.patch.object(cache, "cache_set_many", wraps=cache.cache_set_many) as cache_set_many:
+            self.assertEqual(expected, list(scoring.get_score_bulk(cache, *columns, chunk_size=3)))
+        self.assertEqual([3, 1], [len(call.args[0]) for call in cache_get_many.call_args_list])
+        self.assertEqual([3, 1], [len(call.args[0]) for call in cache_set_many.call_args_list])
+
+    def test_score_key_covers_arguments(self):
+        cache = loadtest.FakeStore(clients=0)
+        self.assertEqual(1.5, scoring.get_score(cache, None, None, "01.01.2000", 1))
+        self.assertEqual(3., scoring.get_score(cache, None, "a@b", "01.01.2000", 1))
+        self.assertEqual(0.5, scoring.get_score(cache, None, None, None, None, "a", "b"))
+        self.assertEqual(0., scoring.get_score(cache, None, None, None, None, "ab", None))
+        self.assertEqual(4, len(cache.data))
+        self.assertEqual(scoring.score_key(None, None, datetime.datetime(2000, 1, 1), 1),
+                         scoring.score_key(None, None, "1.1.2000", 1))
+
+    def test_score_single_flight(self):
+        self.settings.latency = 0.05
+        arguments = {"phone": "79175002040", "email": "stupnikov@otus.ru", "first_name": "a", "last_name": "b"}
+        with mock.patch.object(scoring, "_compute_score", wraps=scoring._compute_score) as compute:
+            threads = [threading.Thread(target=scoring.get_score, args=(self.settings,), kwargs=arguments)
+                       for _ in range(10)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            self.assertEqual(compute.call_count, 1)
+            self.assertEqual(scoring.get_score(self.settings, **arguments), 3.5)
+            self.assertEqual(compute.call_count, 1)
+
+    @cases([
+        ["cars", "otus"],
+        [0, 10],
+        1 | 1 << 10,
+        ["cars", "unknown", "otus", 42],
+    ])
+    def test_interests_encoding(self, value):
+        self.assertEqual(["cars", "otus"], scoring.decode_interests(scoring.encode_interests(value)))
+
+    def test_interests_cache_snapshot(self):
+        cache = scoring.InterestsCache(ttl=60)
+        cache.put(1, 3)
+        cache.put(2, 5, ttl=0)
+        entries = cache.snapshot()
+        self.assertEqual([(1, 3)], [entry[:2] for entry in entries])
+        restored = scoring.InterestsCache()
+        self.assertEqual(1, restored.load(json.loads(json.dumps(entries))))
+        self.assertEqual(3, restored.get(1))
+
+    def test_interests_cache(self):
+        self.settings.data.update({"i:1": ["cars", "pets"], "i:2": [3, 4]})
+        self.assertEqual(1, scoring.warm_interests_cache(self.settings, [1]))
+        self.settings.data.update({"i:1": ["tv"]})
+        interests = scoring.get_interests_many(self.settings, [1, 2, 30])
+        self.assertEqual({1: ["cars", "pets"], 2: ["hi-tech", "sport"], 30: []}, interests)
+        self.assertEqual((1, 2), (scoring.interests_cache.hits, scoring.interests_cache.misses))
+        self.assertEqual(["hi-tech", "sport"], scoring.get_interests(self.settings, 2))
+        self.assertEqual(2, scoring.interests_cache.hits)
+
+    def test_hot_keys_from_access_log(self):
+        request = {"account": "horns&hoofs", "login": "h&f", "method": "clients_interests",
+                   "arguments": {"client_ids": [1, 2]}}
+        batch = {"account": "horns&hoofs", "login": "h&f", "method": "batch",
+                 "arguments": {"requests": [{"method": "clients_interests", "arguments": {"client_ids": [2]}},
+                                            {"method": "online_score", "arguments": {"phone": "79175002040"}}]}}
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "api.log")
+            with open(path, "w") as f:
+                f.write('cut line"body": \n')
+                for body in (request, batch, "{not json"):
+                    f.write(json.dumps({"request_id": "1", "body": json.dumps(body)}) + "\n")
+                f.write(json.dumps({"request_id": "1", "code": api.OK}) + "\n")
+            self.assertEqual(["i:2", "i:1"], warmup.keys_from_access_log(path, 2))
+            self.assertEqual(scoring.score_key("79175002040"), warmup.keys_from_access_log(path, 3)[2])
+
+            path = os.path.join(directory, "hot.keys")
+            with open(path, "w") as f:
+                f.write("i:3\n\nuid:1\ni:4\n")
+            self.assertEqual(["i:3", "uid:1"], warmup.keys_from_file(path, 2))
+
+    def test_warmup(self):
+        self.settings.data.update({"i:1": ["cars", "pets"], scoring.score_key("79175002040"): 3.})
+        keys = ["i:1", "i:2", scoring.score_key("79175002040"), scoring.score_key("79175002041")]
+        cache = shm_cache.SharedScoreCache(slots=64, ttl=60)
+        self.addCleanup(cache.unlink)
+        self.addCleanup(cache.close)
+        with mock.patch.object(scoring, "shared_scores", cache):
+            self.assertEqual({"interests": 2, "scores": 1}, warmup.warm(self.settings, keys, chunk_size=1))
+        self.assertEqual(3., cache.get(scoring.score_key("79175002040")))
+        self.assertEqual(["cars", "pets"], scoring.get_interests(loadtest.FakeStore(clients=0), 1))
+
+        started = threading.Event()
+        release = threading.Event()
+
+        def hot_keys():
+            started.set()
+            release.wait(5)
+            return ["i:3"]
+
+        stage = warmup.Warmup(self.settings, hot_keys, timeout=60)
+        self.assertFalse(stage.ready)
+        stage.start()
+        started.wait(5)
+        self.assertFalse(stage.ready)
+        release.set()
+        self.assertTrue(stage.done.wait(5))
+        self.assertTrue(stage.ready)
+        self.assertTrue(warmup.Warmup(self.settings, hot_keys, timeout=0).start().ready)
+
+
+class TestHTTPServer(unittest.TestCase):
+    handler_class = api_server.MainHTTPHandler
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = api_server.ThreadingHTTPServer(("localhost", 0), cls.handler_class)
+        cls.server_thread = threading.Thread(target=cls.server.serve_forever, daemon=True)
+        cls.server_thread.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        self.connection = http.client.HTTPConnection(*self.server.server_address, timeout=5)
+
+    def tearDown(self):
+        self.connection.close()
+
+    def post(self, path, body: bytes, headers=None):
+        self.connection.request("POST", path, body=body, headers=headers or {})
+        response = self.connection.getresponse()
+        return response, response.read()
+
+    def test_keep_alive(self):
+        response, body = self.post("/method", b'{"login": "h&f"}')
+        sock = self.connection.sock
+        self.assertEqual(api.INVALID_REQUEST, response.status)
+        self.assertEqual(int(response.getheader("Content-Length")), len(body))
+        self.assertFalse(response.will_close)
+        response, body = self.post("/method", b'not json')
+        self.assertEqual(api.BAD_REQUEST, response.status)
+        self.assertIs(sock, self.connection.sock)
+
+    def test_response_not_logged(self):
+        request = {"account": "horns&hoofs", "login": "h&f", "method": "clients_interests",
+                   "arguments": {"client_ids": [1, 2]}, "token": loadtest.user_token("horns&hoofs", "h&f")}
+        with mock.patch.object(self.handler_class, "store", loadtest.FakeStore(clients=10)), \
+                self.assertLogs(level=logging.INFO) as logs:
+            response, body = self.post("/method", json.dumps(request).encode())
+            # the request is logged after its response is sent, but before the next one on the connection is read
+            self.connection.request("GET", "/ready")
+            self.connection.getresponse().read()
+        self.assertEqual(api.OK, response.status)
+        context = [record.msg for record in logs.records if isinstance(record.msg, dict)][-1]
+        self.assertEqual(api.OK, context["code"])
+        self.assertEqual(len(body), context["response_bytes"])
+        self.assertNotIn("response", context)
+
+    def test_no_writes_to_stderr(self):
+        with mock.patch("sys.stderr", new_callable=io.StringIO) as stderr, \
+                self.assertLogs(level=logging.INFO) as logs:
+            response, _ = self.post("/method", b'{"login": "h&f"}')
+            with socket.create_connection(self.server.server_address, timeout=5) as sock:
+                sock.sendall(b"NOT A HTTP REQUEST\r\n\r\n")
+                self.assertIn(b"Error code: 400", sock.makefile("rb").read())
+        self.assertEqual(api.INVALID_REQUEST, response.status)
+        self.assertEqual("", stderr.getvalue())
+        self.assertTrue(any("Bad request" in str(record.msg) for record in logs.records))
+
+    @cases(["-1", str(api_server.MAX_BODY_SIZE + 1), "a lot"])
+    def test_invalid_content_length(self, content_length):
+        started = time.monotonic()
+        with socket.create_connection(self.server.server_address, timeout=5) as sock:
+            sock.sendall(f"POST /method HTTP/1.1\r\nContent-Length: {content_length}\r\n\r\n".encode())
+            response = sock.makefile("rb").read()
+        self.assertLess(time.monotonic() - started, 1)
+        self.assertTrue(response.startswith(b"HTTP/1.1 400"), response)
+        self.assertIn(b"Connection: close", response)
+
+    def test_connection_request_limit(self):
+        self.handler_class.max_requests = 2
+        try:
+            response, _ = self.post("/unknown", b'{"login": "h&f"}')
+            self.assertFalse(response.will_close)
+            response, _ = self.post("/unknown", b'{"login": "h&f"}')
+            self.assertEqual(api.NOT_FOUND, response.status)
+            self.assertTrue(response.will_close)
+            self.assertEqual("close", response.getheader("Connection"))
+        finally:
+            self.handler_class.max_requests = api_server.KEEP_ALIVE_MAX_REQUESTS
+
+    def test_metrics_endpoint(self):
+        request = {"account": "horns&hoofs", "login": "h&f", "method": "online_score", "token": "",
+                   "arguments": {"phone": "79175002040", "email": "stupnikov@otus.ru"}}
+        self.post("/method", json_codec.get_codec("json").dumps(request))
+        self.connection.request("GET", "/metrics")
+        response = self.connection.getresponse()
+        body = response.read().decode("utf-8")
+        self.assertEqual(api.OK, response.status)
+        self.assertTrue(response.getheader("Content-Type").startswith("text/plain"))
+        self.assertIn('api_responses_total{method="online_score",code="403"}', body)
+        self.assertIn('api_request_phase_seconds_count{method="online_score",phase="auth"}', body)
+        self.assertIn('api_request_phase_seconds_bucket{method="online_score",phase="total",le="+Inf"}', body)
+        self.assertIn('api_admission_total{outcome="admitted"}', body)
+        self.assertIn('api_admission_active 0', body)
+
+    def test_gzip_negotiation(self):
+        request = json_codec.get_codec("json").dumps({"login": "h&f"})
+        self.handler_class.gzip_min_size = 0
+        try:
+            response, body = self.post("/method", request, {"Accept-Encoding": "br, gzip"})
+            self.assertEqual("gzip", response.getheader("Content-Encoding"))
+            self.assertEqual(api.INVALID_REQUEST, json.loads(gzip.decompress(body))["code"])
+            for accept_encoding in ("", "gzip;q=0", "identity"):
+                response, body = self.post("/method", request, {"Accept-Encoding": accept_encoding})
+                self.assertIsNone(response.getheader("Content-Encoding"))
+                self.assertEqual(api.INVALID_REQUEST, json.loads(body)["code"])
+        finally:
+            self.handler_class.gzip_min_size = api_server.GZIP_MIN_SIZE
+        response, body = self.post("/method", request, {"Accept-Encoding": "gzip"})
+        self.assertIsNone(response.getheader("Content-Encoding"))
+
+    def test_etag(self):
+        request = {"account": "horns&hoofs", "login": "h&f", "method": "online_score",
+                   "token": loadtest.user_token("horns&hoofs", "h&f"),
+                   "arguments": {"phone": "79175002040", "email": "stupnikov@otus.ru"}}
+        codec = json_codec.get_codec("json")
+        response, body = self.post("/method", codec.dumps(request))
+        self.assertEqual(api.OK, response.status)
+        etag = response.getheader("ETag")
+        self.assertTrue(etag.startswith('W/"'))
+
+        reordered = codec.dumps(dict(reversed(request.items())))
+        with mock.patch.dict(self.handler_class.router, {"method": mock.Mock()}) as router:
+            response, body = self.post("/method", reordered, {"If-None-Match": etag})
+            router["method"].assert_not_called()
+        self.assertEqual(api.NOT_MODIFIED, response.status)
+        self.assertEqual(b"", body)
+        self.assertEqual(etag, response.getheader("ETag"))
+
+        with mock.patch.object(self.handler_class, "data_version", "2"):
+            response, body = self.post("/method", codec.dumps(request), {"If-None-Match": etag})
+        self.assertEqual(api.OK, response.status)
+        self.assertNotEqual(etag, response.getheader("ETag"))
+
+    def test_store_error(self):
+        failing = loadtest.FakeStore(clients=0)
+        request = {"account": "horns&hoofs", "login": "h&f", "method": "clients_interests",
+                   "arguments": {"client_ids": [1, 2]}, "token": loadtest.user_token("horns&hoofs", "h&f")}
+        scoring.interests_cache.clear()
+        with mock.patch.object(failing, "get_many", side_effect=store.StoreUnavailable("circuit breaker is open")), \
+                mock.patch.object(self.handler_class, "store", failing), self.assertLogs(level=logging.WARNING):
+            response, body = self.post("/method", json.dumps(request).encode())
+        self.assertEqual(api.SERVICE_UNAVAILABLE, response.status)
+        self.assertEqual(str(api_server.STORE_RETRY_AFTER), response.getheader("Retry-After"))
+        self.assertEqual(api.SERVICE_UNAVAILABLE, json.loads(body)["code"])
+
+    def test_ready_after_warmup(self):
+        stage = warmup.Warmup(loadtest.FakeStore(clients=0), list, timeout=60)
+        with mock.patch.object(self.handler_class, "warmup", stage):
+            self.connection.request("GET", "/ready")
+            response = self.connection.getresponse()
+            self.assertEqual(api.SERVICE_UNAVAILABLE, json.loads(response.read())["code"])
+            self.assertEqual("1", response.getheader("Retry-After"))
+
+            stage.run()
+            self.connection.request("GET", "/ready")
+            response = self.connection.getresponse()
+            self.assertEqual(api.OK, response.status)
+            self.assertEqual({"ready": True}, json.loads(response.read())["response"])
+
+    def test_capture_and_replay(self):
+        request = {"account": "horns&hoofs", "login": "h&f", "method": "online_score",
+                   "token": loadtest.user_token("horns&hoofs", "h&f"),
+                   "arguments": {"phone": "79175002040", "email": "stupnikov@otus.ru"}}
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "capture.jsonl")
+            traffic = capture.TrafficCapture(path, sample_rate=1.)
+            with mock.patch.object(self.handler_class, "capture", traffic):
+                self.post("/method", json.dumps(request).encode("utf-8"))
+                self.post("/method", b'{"login": "h&f"}')
+                self.post("/method", b'{"login":')
+                # requests are recorded after the response is sent, the connection is served by one thread
+                self.connection.request("GET", "/ready")
+                self.connection.getresponse().read()
+            traffic.close()
+            with open(path, "a") as f:
+                f.write('{"ts": 1, "path": "/method", "bo')
+            records = replay.read_capture(path)
+        self.assertEqual([api.OK, api.INVALID_REQUEST, api.BAD_REQUEST], [record["code"] for record in records])
+        self.assertEqual(b'{"login": "h&f"}', records[1]["body"])
+        self.assertTrue(all(record["elapsed"] >= 0 for record in records))
+
+        url = "http://%s:%d" % self.server.server_address[:2]
+        result = replay.replay(url, records, speed=0, concurrency=2)
+        self.assertEqual(3, result["requests"])
+        self.assertEqual({}, result["code_mismatches"])
+        self.assertEqual(1, result["latency_ms"]["online_score"]["count"])
+        self.assertEqual(3, result["recorded_latency_ms"]["all"]["count"])
+
+        for offset, record in enumerate(records):
+            record["ts"] = records[0]["ts"] + offset * 0.2
+        self.assertGreaterEqual(replay.replay(url, records, speed=2, concurrency=3)["duration"], 0.2)
+
+    def test_error_response_written_at_once(self):
+        api_server.encode_error.cache_clear()
+        writer = socketserver._SocketWriter
+        with mock.patch.object(writer, "write", autospec=True, side_effect=writer.write) as write:
+            for _ in range(2):
+                response, body = self.post("/method", b'{"login": "h&f"}')
+        self.assertEqual(api.INVALID_REQUEST, response.status)
+        self.assertEqual(2, write.call_count)
+        self.assertTrue(write.call_args.args[1].startswith(b"HTTP/1.1 422 "))
+        self.assertTrue(write.call_args.args[1].endswith(b"\r\n\r\n" + body))
+        cache_info = api_server.encode_error.cache_info()
+        self.assertEqual((1, 1), (cache_info.hits, cache_info.misses))
+
+    def test_overload_rejected(self):
+        self.handler_class.admission = admission.AdmissionController(concurrency=0, queue_size=0)
+        try:
+            response, body = self.post("/method", b'{"login": "h&f"}')
+        finally:
+            self.handler_class.admission = admission.AdmissionController()
+        self.assertEqual(api.SERVICE_UNAVAILABLE, response.status)
+        self.assertEqual("1", response.getheader("Retry-After"))
+        self.assertTrue(response.will_close)
+        self.assertEqual(api.SERVICE_UNAVAILABLE, json.loads(body)["code"])
+
+    def test_loadtest_smoke(self):
+        server = loadtest.start_local_server(loadtest.FakeStore(latency=0.001, clients=10))
+        try:
+            url = "http://%s:%d/method" % server.server_address[:2]
+            result = loadtest.run(url, 2, 0.3, loadtest.build_requests(20, 0.5, 3, 10))
+        finally:
+            server.shutdown()
+            server.server_close()
+        self.assertGreater(result["requests"], 0)
+        self.assertEqual({api.OK: result["requests"]}, result["codes"])
+        self.assertLessEqual(result["latency_ms"]["all"]["p50"], result["latency_ms"]["all"]["p99"])
+
+
+class TestStoreCircuitBreaker(unittest.TestCase):
+    def setUp(self):
+        # nothing listens on port 0, so every Redis call fails at once
+        self.breaker = store.CircuitBreaker(failure_threshold=3, reset_timeout=60)
+        self.store = store.Store('localhost', 0, retries=10, breaker=self.breaker)
+        self.store.connect()
+
+    def tearDown(self):
+        self.store.disconnect()
+
+    def test_breaker_opens_and_fails_fast(self):
+        with self.assertRaises(store.StoreError):
+            self.store.get("i:1")
+        self.assertEqual(self.breaker.OPEN, self.breaker.state)
+        self.assertEqual(3, self.store.stats["failures"])
+        with self.assertRaises(store.StoreUnavailable):
+            self.store.get("i:1")
+        self.assertIsNone(self.store.cache_get("uid:1"))
+        self.assertEqual(2, self.store.stats["rejected"])
+
+    def test_breaker_half_open_probe(self):
+        breaker = store.CircuitBreaker(failure_threshold=1, reset_timeout=0)
+        breaker.record_failure()
+        self.assertTrue(breaker.allow())
+        self.assertEqual(breaker.HALF_OPEN, breaker.state)
+        self.assertFalse(breaker.allow())
+        breaker.record_success()
+        self.assertEqual(breaker.CLOSED, breaker.state)
+        self.assertTrue(breaker.allow())
+
+    def test_deadline(self):
+        deadline = store.Deadline(0)
+        with self.assertRaises(store.StoreTimeout):
+            self.store.get("i:1", deadline=deadline)
+        self.assertEqual(self.breaker.CLOSED, self.breaker.state)
+
+    def test_store_wait_in_context(self):
+        request = {"account": "horns&hoofs", "login": "h&f", "method": "clients_interests",
+                   "arguments": {"client_ids": [1, 2]}, "token": loadtest.user_token("horns&hoofs", "h&f")}
+        context = {}
+        scoring.interests_cache.clear()
+        with self.assertLogs(level=logging.WARNING) as logs:
+            response, code = api_server.method_handler({"body": request, "headers": {}}, context, self.store)
+        self.assertEqual(api.SERVICE_UNAVAILABLE, code)
+        self.assertIn("store_wait", context)
+        self.assertEqual([None], [record.exc_info for record in logs.records if record.name == "root"])
+
+
+class TestStoreDeadline(unittest.TestCase):
+    def setUp(self):
+        # the server accepts connections but never answers, so only socket timeouts end the calls
+        self.listener = socket.socket()
+        self.listener.bind(("localhost", 0))
+        self.listener.listen(16)
+        self.store = store.Store('localhost', self.listener.getsockname()[1], timeout=3, retries=10,
+                                 breaker=store.CircuitBreaker(failure_threshold=100))
+        self.store.connect()
+
+    def tearDown(self):
+        self.store.disconnect()
+        self.listener.close()
+
+    def test_cache_call_times_out(self):
+        started = time.monotonic()
+        with self.assertLogs("store", level=logging.WARNING) as logs:
+            self.assertIsNone(self.store.cache_get("uid:1"))
+            self.assertEqual([None, None], self.store.cache_get_many(["uid:1", "uid:2"]))
+        self.assertLess(time.monotonic() - started, 2)
+        self.assertEqual([None, None], [record.exc_info for record in logs.records])
+        self.assertIn("2 key(s)", logs.records[1].getMessage())
+        self.assertTrue(logs.records[1].getMessage().endswith(": StoreError"))
+
+    def test_call_bounded_by_deadline(self):
+        deadline = store.Deadline(0.3)
+        started = time.monotonic()
+        with self.assertRaises(store.StoreError):
+            self.store.get("i:1", deadline=deadline)
+        self.assertLess(time.monotonic() - started, 1)
+        self.assertIsNone(self.store.cache_get_many(["uid:1"], deadline=store.Deadline(0.3))[0])
+        self.store.cache_set_many({"uid:1": 1}, 60, deadline=store.Deadline(0.3))
+        self.assertLess(time.monotonic() - started, 2)
+
+
+class TestServerWorkerStop(unittest.TestCase):
+    def setUp(self):
+        self.server = api_server.ThreadingHTTPServer(("localhost", 0), api_server.MainHTTPHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.worker = api_server.ServerWorker(drain_timeout=5)
+        self.worker.log_listener = mock.Mock()
+
+    def test_stop_waits_for_open_connections(self):
+        idle = http.client.HTTPConnection(*self.server.server_address, timeout=5)
+        idle.request("POST", "/method", body=b'{"login": "h&f"}')
+        self.assertEqual(api.INVALID_REQUEST, idle.getresponse().status)
+        # the headers are sent, but the body is not
+        busy = socket.create_connection(self.server.server_address, timeout=5)
+        busy.sendall(b"POST /method HTTP/1.1\r\nContent-Length: 16\r\n\r\n")
+        time.sleep(0.1)
+        self.assertEqual(2, len(api_server.MainHTTPHandler.open_connections))
+
+        self.server.shutdown()
+        stopper = threading.Thread(target=self.worker.stop)
+        with mock.patch.object(api_server.MainHTTPHandler, "draining", True), \
+                mock.patch.object(api_server.MainHTTPHandler, "store", mock.Mock()):
+            stopper.start()
+            stopper.join(0.2)
+            self.assertTrue(stopper.is_alive())
+            self.assertEqual(b"", idle.sock.recv(1))
+            busy.sendall(b'{"login": "h&f"}')
+            response = busy.makefile("rb").read()
+            stopper.join(5)
+        self.assertFalse(stopper.is_alive())
+        self.assertTrue(response.startswith(b"HTTP/1.1 422"))
+        self.assertIn(b"Connection: close", response)
+        self.assertEqual(set(), api_server.MainHTTPHandler.open_connections)
+        idle.close()
+        busy.close()
+
+
+class TestSupervisor(unittest.TestCase):
+    def test_stop_during_reload(self):
+        stopped, stopping = os.pipe()
+        workers = supervisor.Supervisor(mock.Mock(), 2, mock.Mock())
+        workers.generation = {1: stopped}
+
+        def terminate(generation):
+            if generation:
+                # the old worker hands over and SIGTERM arrives while the supervisor waits for it
+                os.close(stopping)
+                workers.stop()
+
+        with mock.patch.object(workers, "_terminate", side_effect=terminate), \
+                mock.patch.object(workers, "_fork") as fork:
+            workers.reload()
+        fork.assert_not_called()
+        self.assertEqual({}, workers.generation)
+        self.assertFalse(workers._reloading)
+
+
+class TestGracefulReload(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.log = os.path.join(self.directory.name, "api.log")
+        self.snapshot = os.path.join(self.directory.name, "interests.snapshot")
+        with socket.socket() as probe:
+            probe.bind(("localhost", 0))
+            self.port = probe.getsockname()[1]
+        self.process = subprocess.Popen(
+            [sys.executable, "api.py", "-p", str(self.port), "--workers", "2", "--warm-interests", "0",
+             "--storage-path", os.path.join(self.directory.name, "store.db"), "-l", self.log,
+             "--cache-snapshot", self.snapshot],
+            cwd=os.path.dirname(os.path.abspath(__file__)), stderr=subprocess.DEVNULL, start_new_session=True,
+        )
+        self.addCleanup(self.directory.cleanup)
+
+    def tearDown(self):
+        if self.process.poll() is None:
+            # workers left behind by a failed test would keep the output pipes of the test runner open
+            os.killpg(self.process.pid, signal.SIGKILL)
+            self.process.wait()
+
+    def started_workers(self) -> list:
+        if not os.path.exists(self.log):
+            return []
+        with open(self.log) as f:
+            return [line for line in f if "started with" in line]
+
+    def wait_for_workers(self, count: int):
+        for _ in range(500):
+            if len(self.started_workers()) >= count:
+                return
+            time.sleep(0.01)
+        self.fail(f"{count} workers have not started")
+
+    def post(self) -> int:
+        request = {"account": "horns&hoofs", "login": "h&f", "method": "clients_interests",
+                   "token": loadtest.user_token("horns&hoofs", "h&f"), "arguments": {"client_ids": [1, 2]}}
+        connection = http.client.HTTPConnection("localhost", self.port, timeout=5)
+        try:
+            connection.request("POST", "/method", json.dumps(request))
+            return connection.getresponse().status
+        finally:
+            connection.close()
+
+    def test_reload_keeps_serving(self):
+        self.wait_for_workers(2)
+        self.assertEqual(api.OK, self.post())
+
+        self.process.send_signal(signal.SIGHUP)
+        statuses = [self.post() for _ in range(20)]
+        self.wait_for_workers(4)
+        self.assertEqual([api.OK] * 20, statuses)
+        self.assertTrue(os.path.exists(self.snapshot))
+        with open(self.log) as f:
+            self.assertIn("Interests cache loaded from snapshot", f.read())
+
+        self.process.send_signal(signal.SIGTERM)
+        self.assertEqual(0, self.process.wait(10))
+
+
+class TestCommandLine(unittest.TestCase):
+    # cumulative time in seconds of `import api` reported by -X importtime; it is ~0.03 s now, and it was ~0.12 s
+    # when the server was imported with it and ~0.24 s when redis and numpy were too
+    IMPORT_TIME_BUDGET = 0.1
+    # needed only by the server, so command-line uses must not import them
+    SERVER_MODULES = ("redis", "numpy", "sqlite3", "multiprocessing", "http.server", "api_server", "store", "scoring",
+                      "supervisor", "warmup", "metrics", "admission", "capture", "gzip", "optparse")
+
+    def run_api(self, *args) -> subprocess.CompletedProcess:
+        return subprocess.run([sys.executable, *args], cwd=os.path.dirname(os.path.abspath(__file__)),
+                              capture_output=True, text=True, timeout=60)
+
+    def import_times(self) -> dict:
+        times = {}
+        for line in self.run_api("-X", "importtime", "-c", "import api").stderr.splitlines():
+            if line.startswith("import time:"):
+                _, cumulative, name = line.removeprefix("import time:").split("|")
+                if cumulative.strip().isdigit():
+                    times[name.strip()] = int(cumulative) / 1e6
+        return times
+
+    def test_import_time_budget(self):
+        runs = [self.import_times() for _ in range(3)]
+        self.assertEqual([], [name for name in runs[0]
+                              if name in self.SERVER_MODULES or name.split(".")[0] in self.SERVER_MODULES])
+        self.assertLess(min(times["api"] for times in runs), self.IMPORT_TIME_BUDGET)
+
+    def test_validate(self):
+        token = loadtest.user_token("horns&hoofs", "h&f")
+        valid = {"account": "horns&hoofs", "login": "h&f", "method": "online_score", "token": token,
+                 "arguments": {"phone": "79175002040", "email": "stupnikov@otus.ru"}}
+        batch = {"account": "horns&hoofs", "login": "h&f", "method": "batch", "token": token,
+                 "arguments": {"requests": [valid, {**valid, "arguments": {"phone": "79175002040"}}]}}
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "requests.jsonl")
+            with open(path, "w") as f:
+                for line in (valid, {**valid, "token": "bad"}, batch, {**valid, "method": "score"}, [valid]):
+                    f.write(json.dumps(line) + "\n")
+                f.write("\n{not json\n")
+            result = self.run_api("api.py", "validate", path)
+        self.assertEqual(1, result.returncode, result.stderr)
+        report = json.loads(result.stdout)
+        self.assertEqual((6, 2, 4), (report["records"], report["valid"], report["invalid"]))
+        self.assertEqual({
+            "Not enough data provided": 1,
+            "Requested method score not found": 1,
+            "Request must be a JSON object": 1,
+            "Invalid JSON": 1,
+        }, report["errors"])
+
+    def test_token(self):
+        result = self.run_api("api.py", "token", "--account", "a", "--login", "b")
+        self.assertEqual(loadtest.user_token("a", "b"), result.stdout.strip())
+        result = self.run_api("api.py", "token", "--login", api.ADMIN_LOGIN)
+        self.assertEqual(api.admin_token.get().decode("ascii"), result.stdout.strip())
+
+
+class TestBulkValidate(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def path(self, name: str) -> str:
+        return os.path.join(self.directory.name, name)
+
+    def test_read_blocks(self):
+        data = b'{"a": 1}\n{"b": 22222222222}\n\n{"c": 3}'
+        for block_size in (1, 5, 12, 1024):
+            blocks = list(bulk_validate.read_blocks(io.BytesIO(data), block_size))
+            self.assertEqual(data, b"".join(block for _, block in blocks))
+            self.assertTrue(all(block.endswith(b"\n") for _, block in blocks[:-1]))
+            offset = 0
+            for line_number, block in blocks:
+                self.assertEqual(data.count(b"\n", 0, offset) + 1, line_number)
+                offset += len(block)
+
+    def test_validate_file(self):
+        token = loadtest.user_token("horns&hoofs", "h&f")
+        valid = {"account": "horns&hoofs", "login": "h&f", "method": "clients_interests", "token": token,
+                 "arguments": {"client_ids": [1, 2]}}
+        lines = []
+        for index in range(300):
+            if index % 3 == 0:
+                lines.append(json.dumps({**valid, "arguments": {"client_ids": []}}))
+            elif index % 7 == 0:
+                lines.append("{not json")
+            else:
+                lines.append(json.dumps({**valid, "arguments": {"client_ids": [index]}}))
+        with open(self.path("requests.jsonl"), "w") as f:
+            f.write("\n".join(lines))
+
+        reports = []
+        for processes in (1, 2):
+            report = bulk_validate.validate_file(self.path("requests.jsonl"), self.path("valid.jsonl"),
+                                                 self.path("invalid.jsonl"), processes, block_size=1000)
+            reports.append({key: report[key] for key in ("records", "valid", "invalid", "errors")})
+            with open(self.path("valid.jsonl")) as f:
+                self.assertEqual([line for line in lines if "[]" not in line and "not json" not in line],
+                                 f.read().splitlines())
+            with open(self.path("invalid.jsonl")) as f:
+                invalid = [json.loads(line) for line in f]
+            self.assertEqual([index + 1 for index, line in enumerate(lines) if "[]" in line or "not json" in line],
+                             [record["line"] for record in invalid])
+            self.assertEqual(lines[invalid[1]["line"] - 1], invalid[1]["record"])
+        self.assertEqual(reports[0], reports[1])
+        self.assertEqual({"records": 300, "valid": 172, "invalid": 128, "errors": {
+            "Validation Error: client IDs list must not be empty": 100,
+            "Invalid JSON": 28,
+        }}, reports[0])
+
+    def test_validate_block_method(self):
+        item = {"account": "horns&hoofs", "login": "h&f", "method": "clients_interests", "token": "",
+                "arguments": {"client_ids": [1]}}
+        records = [
+            {**item, "method": []},
+            {**item, "method": {}},
+            {**item, "method": "batch", "arguments": {"requests": [item]}},
+            {**item, "method": "batch", "arguments": {"requests": [{**item, "method": "batch",
+                                                                    "arguments": {"requests": [item]}}]}},
+        ]
+        block = b"".join(json.dumps(record).encode() + b"\n" for record in records)
+        records, valid, _, errors = bulk_validate.validate_block(1, block)
+        self.assertEqual((4, 1), (records, valid.count(b"\n")))
+        self.assertEqual({"Requested method [] not found": 1, "Requested method {} not found": 1,
+                          "Requested method batch not found": 1}, errors)
+
+    def test_validate_block_unexpected_error(self):
+        block = b'{"method": "first"}\n{"method": "second"}\n'
+        with mock.patch.object(api, "validate_request", side_effect=[TypeError("broken"), None]):
+            records, valid, invalid, errors = bulk_validate.validate_block(1, block)
+        self.assertEqual((2, b'{"method": "second"}\n'), (records, valid))
+        self.assertEqual({"Unexpected error: TypeError: broken": 1}, errors)
+        self.assertEqual(1, json.loads(invalid)["line"])
+
+
+class TestAdmissionController(unittest.TestCase):
+    def test_concurrency_limit(self):
+        controller = admission.AdmissionController(concurrency=2, queue_size=1, queue_timeout=0.01)
+        self.assertTrue(controller.acquire())
+        self.assertTrue(controller.acquire())
+        self.assertFalse(controller.acquire())
+        self.assertEqual(controller.stats["timeouts"], 1)
+        controller.release()
+        self.assertTrue(controller.acquire())
+        self.assertEqual(controller.snapshot(), {"admitted": 3, "queued": 1, "rejected": 0, "timeouts": 1,
+                                                 "active": 2, "waiting": 0})
+
+    def test_full_queue_rejects_at_once(self):
+        controller = admission.AdmissionController(concurrency=1, queue_size=1, queue_timeout=5)
+        self.assertTrue(controller.acquire())
+        waiter = threading.Thread(target=controller.acquire)
+        waiter.start()
+        while not controller.waiting:
+            time.sleep(0.001)
+        self.assertFalse(controller.acquire())
+        self.assertEqual(controller.stats["rejected"], 1)
+        controller.release()
+        waiter.join()
+        self.assertEqual(controller.active, 1)
+
+    def _queue(self, controller, count):
+        admitted = []
+        threads = []
+        for index in range(count):
+            thread = threading.Thread(target=lambda index=index: controller.acquire() and admitted.append(index))
+            thread.start()
+            threads.append(thread)
+            while controller.waiting <= index:
+                time.sleep(0.001)
+        return admitted, threads
+
+    def test_fifo_then_lifo_under_pressure(self):
+        controller = admission.AdmissionController(concurrency=1, queue_size=10, queue_timeout=5, lifo_threshold=2)
+        self.assertTrue(controller.acquire())
+        admitted, threads = self._queue(controller, 4)
+        for _ in range(4):
+            controller.release()
+            while len(admitted) < controller.stats["admitted"] - 1:
+                time.sleep(0.001)
+        for thread in threads:
+            thread.join()
+        # the newest waiters are served while the queue is longer than the threshold, then the oldest ones
+        self.assertEqual(admitted, [3, 2, 0, 1])
+
+
+class TestSharedScoreCache(unittest.TestCase):
+    def setUp(self):
+        self.cache = shm_cache.SharedScoreCache(slots=64, ttl=60)
+
+    def tearDown(self):
+        self.cache.close()
+        self.cache.unlink()
+
+    def test_get_and_put(self):
+        self.assertIsNone(self.cache.get("uid:1"))
+        self.cache.put("uid:1", 3.5)
+        self.cache.put("uid:2", 0.)
+        self.cache.put("uid:1", 1.5)
+        self.assertEqual(self.cache.get("uid:1"), 1.5)
+        self.assertEqual(self.cache.get("uid:2"), 0.)
+        self.assertEqual((self.cache.hits, self.cache.misses), (2, 1))
+
+    def test_expiry_and_eviction(self):
+        self.cache.put("uid:1", 3.5)
+        with mock.patch("time.time", return_value=time.time() + 61):
+            self.assertIsNone(self.cache.get("uid:1"))
+        for index in range(1000):
+            self.cache.put(f"uid:{index}", float(index))
+        self.assertEqual(self.cache.get("uid:999"), 999.)
+
+    def test_shared_between_processes(self):
+        worker = multiprocessing.get_context("fork").Process(target=self.cache.put, args=("uid:1", 3.5))
+        worker.start()
+        worker.join()
+        self.assertEqual(self.cache.get("uid:1"), 3.5)
+        attached = shm_cache.SharedScoreCache(slots=64, name=self.cache.name)
+        self.assertEqual(attached.get("uid:1"), 3.5)
+        attached.close()
+
+    def test_score_read_from_shared_cache(self):
+        arguments = {"phone": "79175002040", "email": "stupnikov@otus.ru"}
+        self.cache.put(scoring.score_key(**arguments), 100.)
+        with mock.patch.object(scoring, "shared_scores", self.cache):
+            self.assertEqual(scoring.get_score(loadtest.FakeStore(clients=0), **arguments), 100.)
+            columns = [[arguments["phone"]], [arguments["email"]], [None], [None], [None], [None]]
+            self.assertEqual([100.], list(scoring.get_score_bulk(loadtest.FakeStore(clients=0), *columns)))
+
+
+class TestShardedStore(unittest.TestCase):
+    def setUp(self):
+        self.nodes = {f"node{i}": loadtest.FakeStore(clients=0) for i in range(4)}
+        self.store = store.ShardedStore(self.nodes)
+        scoring.interests_cache.clear()
+
+    def test_keys_spread_over_nodes(self):
+        keys = [f"i:{cid}" for cid in range(10000)]
+        owners = collections.Counter(self.store.ring.get(key) for key in keys)
+        self.assertEqual(set(owners), set(self.nodes))
+        for count in owners.values():
+            self.assertLess(abs(count - 2500), 500)
+
+    def test_adding_node_remaps_few_keys(self):
+        keys = [f"i:{cid}" for cid in range(10000)]
+        before = {key: self.store.ring.get(key) for key in keys}
+        self.store.add_node("node4", loadtest.FakeStore(clients=0))
+        moved = [key for key in keys if self.store.ring.get(key) != before[key]]
+        # only keys taken over by the new node move, about 1/5 of them
+        self.assertTrue(all(self.store.ring.get(key) == "node4" for key in moved))
+        self.assertLess(len(moved), 3000)
+
+    def test_bulk_operations_grouped_by_node(self):
+        mapping = {f"uid:{i}": float(i) for i in range(100)}
+        with mock.patch.object(loadtest.FakeStore, "cache_set_many", autospec=True,
+                               side_effect=loadtest.FakeStore.cache_set_many) as cache_set_many:
+            self.store.cache_set_many(mapping, 60)
+        self.assertEqual(cache_set_many.call_count, len(self.nodes))
+
+        keys = list(mapping) + ["uid:missing"]
+        with mock.patch.object(loadtest.FakeStore, "cache_get_many", autospec=True,
+                               side_effect=loadtest.FakeStore.cache_get_many) as cache_get_many:
+            values = self.store.cache_get_many(keys)
+        self.assertEqual(cache_get_many.call_count, len(self.nodes))
+        self.assertEqual(values, list(mapping.values()) + [None])
+        self.assertEqual(self.store.cache_get("uid:7"), 7.)
+        self.assertIn("uid:7", self.store.node("uid:7").data)
+
+    def test_method_handler_with_sharded_store(self):
+        for cid in range(10):
+            self.store.node(f"i:{cid}").data[f"i:{cid}"] = ["cars"]
+        request = {"account": "horns&hoofs", "login": "h&f", "method": "clients_interests",
+                   "token": loadtest.user_token("horns&hoofs", "h&f"), "arguments": {"client_ids": [1, 2, 3]}}
+        context = {}
+        response, code = api_server.method_handler({"body": request, "headers": {}}, context, self.store)
+        self.assertEqual(code, api.OK)
+        self.assertEqual(response, {1: ["cars"], 2: ["cars"], 3: ["cars"]})
+        self.assertIn("store_wait", context)
+
+
+class TestEmbeddedStore(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.store = embedded_store.EmbeddedStore(os.path.join(self.directory.name, "store.db"), sweep_interval=60)
+        self.store.connect()
+        scoring.interests_cache.clear()
+
+    def tearDown(self):
+        self.store.disconnect()
+        self.directory.cleanup()
+
+    def test_get_and_set(self):
+        self.store.set_many({"i:1": ["cars", "pets"], "i:2": ["books"]})
+        self.assertEqual(self.store.get("i:1"), ["cars", "pets"])
+        self.assertEqual(self.store.get_many(["i:2", "i:3", "i:1"]), [["books"], None, ["cars", "pets"]])
+        self.assertEqual(sorted(self.store.scan("i:*", 10)), ["i:1", "i:2"])
+
+        self.store.cache_set("uid:1", 3.5, 60)
+        self.store.cache_set_many({"uid:2": 1.5, "uid:3": 0.}, 60)
+        self.assertEqual(self.store.cache_get("uid:1"), 3.5)
+        self.assertEqual(self.store.cache_get_many(["uid:3", "uid:4", "uid:2"]), [0., None, 1.5])
+
+    def test_cache_expiry(self):
+        self.store.cache_set("uid:1", 3.5, 60)
+        with mock.patch("time.time", return_value=time.time() + 61):
+            self.assertIsNone(self.store.cache_get("uid:1"))
+            self.assertEqual(self.store.sweep(), 1)
+        self.assertIsNone(self.store.cache_get("uid:1"))
+        self.assertEqual(self.store.stats["expired"], 1)
+
+    def test_database_errors(self):
+        with mock.patch.object(self.store, "_select", side_effect=sqlite3.OperationalError("disk I/O error")):
+            with self.assertNoLogs("store", level=logging.DEBUG):
+                with self.assertRaises(store.StoreError):
+                    self.store.get_many(["i:1"])
+            with self.assertLogs("store", level=logging.WARNING) as logs:
+                self.assertEqual(self.store.cache_get_many(["uid:1", "uid:2"]), [None, None])
+        self.assertEqual([None], [record.exc_info for record in logs.records])
+        self.assertIn("2 key(s)", logs.records[0].getMessage())
+
+    def test_method_handler_with_embedded_store(self):
+        self.store.set_many({f"i:{cid}": ["cars"] for cid in range(3)})
+        request = {"account": "horns&hoofs", "login": "h&f", "method": "clients_interests",
+                   "token": loadtest.user_token("horns&hoofs", "h&f"), "arguments": {"client_ids": [1, 2, 3]}}
+        context = {}
+        response, code = api_server.method_handler({"body": request, "headers": {}}, context, self.store)
+        self.assertEqual(code, api.OK)
+        self.assertEqual(response, {1: ["cars"], 2: ["cars"], 3: []})
+        self.assertIn("store_wait", context)
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,122 @@
+import collections
+import json
+import logging
+import os
+import threading
+import time
+
+import scoring
+from store import StoreError
+
+WARMUP_TIMEOUT = 30  # seconds after which a worker reports ready even if the warm-up has not finished
+WARMUP_CHUNK_SIZE = 1000  # keys read from the store with one bulk call
+LOG_TAIL_SIZE = 64 << 20  # bytes at the end of the access log sampled for hot keys
+
+
+def keys_from_file(path: str, limit: int) -> list[str]:
+    """
+    First `limit` keys of a file with one key per line, hottest first: i:<client id> for interests,
+    uid:<hash> for scores.
+    """
+    keys = []
+    with open(path) as f:
+        for line in f:
+            key = line.strip()
+            if key:
+                keys.append(key)
+                if len(keys) >= limit:
+                    break
+    return keys
+
+
+def _request_keys(request: dict):
+    if not isinstance(request, dict) or not isinstance(request.get("arguments"), dict):
+        return
+    arguments = request["arguments"]
+    if request.get("method") == "batch":
+        for item in arguments.get("requests") or ():
+            yield from _request_keys(item)
+    elif request.get("method") == "clients_interests":
+        for cid in arguments.get("client_ids") or ():
+            yield f"i:{cid}"
+    elif request.get("method") == "online_score":
+        yield scoring.score_key(arguments.get("phone"), arguments.get("email"), arguments.get("birthday"),
+                                arguments.get("gender"), arguments.get("first_name"), arguments.get("last_name"))
+
+
+def keys_from_access_log(path: str, limit: int, tail_size: int = LOG_TAIL_SIZE) -> list[str]:
+    """
+    Keys most often used by the request bodies sampled into the end of the access log, hottest first.
+    """
+    counts = collections.Counter()
+    with open(path, "rb") as f:
+        f.seek(max(0, os.fstat(f.fileno()).st_size - tail_size))
+        for line in f:
+            if b'"body"' not in line:
+                continue
+            try:
+                body = json.loads(json.loads(line)["body"])
+            except (ValueError, KeyError, TypeError):
+                # the first line of the tail is cut, bodies may be truncated or not JSON at all
+                continue
+            counts.update(_request_keys(body))
+    return [key for key, _ in counts.most_common(limit)]
+
+
+def warm(store, keys: list[str], chunk_size: int = WARMUP_CHUNK_SIZE) -> dict:
+    """
+    Load interests of i:<client id> keys into the local interests cache and cached scores of uid:<hash> keys into
+    the score cache shared by workers, with one bulk store call per chunk. Returns numbers of loaded entries.
+    """
+    cids = [int(key[2:]) for key in keys if key.startswith("i:") and key[2:].isdigit()]
+    scoring.warm_interests_cache(store, cids, chunk_size)
+
+    scores = 0
+    score_keys = [key for key in keys if key.startswith("uid:")] if scoring.shared_scores is not None else []
+    for start in range(0, len(score_keys), chunk_size):
+        chunk = score_keys[start:start + chunk_size]
+        for key, score in zip(chunk, store.cache_get_many(chunk)):
+            if score is not None:
+                scoring.shared_scores.put(key, score)
+                scores += 1
+    return {"interests": len(cids), "scores": scores}
+
+
+class Warmup:
+    """
+    Warm-up of the local caches running in a background thread while the worker already serves requests.
+    The worker is ready once the warm-up has finished or `timeout` seconds have passed.
+
+    Args:
+        store: store to read the hot keys from
+        hot_keys: callable returning the keys to load, hottest first
+        timeout: float, time in seconds after which the worker is ready anyway (default: WARMUP_TIMEOUT)
+    """
+
+    def __init__(self, store, hot_keys, timeout: float = WARMUP_TIMEOUT):
+        self.store = store
+        self.hot_keys = hot_keys
+        self.timeout = timeout
+        self.done = threading.Event()
+        self._deadline = None
+
+    @property
+    def ready(self) -> bool:
+        return self.done.is_set() or (self._deadline is not None and time.monotonic() >= self._deadline)
+
+    def start(self) -> 'Warmup':
+        self._deadline = time.monotonic() + self.timeout
+        threading.Thread(target=self.run, name="warmup", daemon=True).start()
+        return self
+
+    def run(self):
+        started = time.monotonic()
+        try:
+            loaded = warm(self.store, self.hot_keys())
+        except (OSError, StoreError):
+            logging.exception("Cache warm-up failed, serving with cold caches")
+        else:
+            logging.info("Caches warmed up in %.3f s: %d clients, %d scores"
+                         % (time.monotonic() - started, loaded["interests"], loaded["scores"]))
+        finally:
+            self.done.set()